@@ -0,0 +1,247 @@
+import io
+import math
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+# --------------------------
+# Формирование актов по шаблону
+# --------------------------
+
+# python-docx импортируется при первой компиляции шаблона, а не при
+# импорте модуля: большинству перезапусков скрипта акты не нужны
+TEMPLATE_PATH = "template.docx"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+ZIP_MIME = "application/zip"
+
+# Пакетное формирование: число процессов, размер порции записей на
+# процесс и размер пакета, начиная с которого имеет смысл пул
+ACT_WORKERS = int(os.environ.get("ACT_WORKERS", str(os.cpu_count() or 1)))
+ACT_CHUNK_SIZE = 25
+PARALLEL_MIN_RECORDS = 50
+
+# Поля записи, которые подставляются в шаблон вместо {поле}
+PLACEHOLDERS = [
+    "inspection_date",
+    "object",
+    "section",
+    "organization",
+    "violator_name",
+    "violation_description",
+    "violation_type",
+    "violation_category",
+    "risk_level",
+    "inspector_name",
+    "elimination_date",
+    "elimination_status",
+]
+
+_PLACEHOLDER_RE = re.compile(r"\{(%s)\}" % "|".join(PLACEHOLDERS))
+# Части документа, в которых ищутся поля
+_TEXT_PARTS = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+_LINE_BREAK = '</w:t><w:br/><w:t xml:space="preserve">'
+
+
+class ActTemplate:
+    """Шаблон акта, разобранный один раз.
+
+    Word часто разбивает {поле} на несколько фрагментов (runs) из-за
+    проверки орфографии и правок. При компиляции такие поля собираются
+    в один фрагмент, после чего XML частей документа режется на куски
+    вокруг полей. Сборка акта — это склейка строк и запись zip-архива,
+    без повторного разбора docx.
+    """
+
+    def __init__(self, path=TEMPLATE_PATH):
+        from docx import Document
+        from docx.oxml.ns import qn
+
+        doc = Document(path)
+        for part in doc.part.package.iter_parts():
+            if _TEXT_PARTS.fullmatch(part.partname.lstrip("/")):
+                for paragraph in part.element.iter(qn("w:p")):
+                    _merge_split_placeholders(paragraph)
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        self._parts = []
+        with zipfile.ZipFile(buffer) as zf:
+            for info in zf.infolist():
+                data = zf.read(info)
+                if _TEXT_PARTS.fullmatch(info.filename):
+                    # Чётные элементы — XML как есть, нечётные — имена полей
+                    data = _PLACEHOLDER_RE.split(data.decode("utf-8"))
+                self._parts.append((info.filename, data))
+
+    def render(self, record):
+        """Акт для записи `record` (словарь поле -> значение) в виде bytes."""
+        values = {name: _xml_text(record.get(name)) for name in PLACEHOLDERS}
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, data in self._parts:
+                if isinstance(data, list):
+                    chunks = data[:]
+                    chunks[1::2] = [values[field] for field in data[1::2]]
+                    data = "".join(chunks).encode("utf-8")
+                zf.writestr(name, data)
+        return buffer.getvalue()
+
+
+def _merge_split_placeholders(p):
+    from docx.oxml.ns import qn
+
+    # Пока в абзаце есть поле, разрезанное между фрагментами, переносим
+    # его целиком в первый фрагмент, а из остальных убираем его части
+    while True:
+        runs = [r for r in p.iter(qn("w:r")) if r.getparent() is p]
+        texts = ["".join(t.text or "" for t in r.iter(qn("w:t"))) for r in runs]
+        offsets, position = [], 0
+        for text in texts:
+            offsets.append(position)
+            position += len(text)
+
+        for match in _PLACEHOLDER_RE.finditer("".join(texts)):
+            first = _run_at(offsets, texts, match.start())
+            last = _run_at(offsets, texts, match.end() - 1)
+            if first != last:
+                break
+        else:
+            break
+
+        head = texts[first][:match.start() - offsets[first]]
+        tail = texts[last][match.end() - offsets[last]:]
+        _set_run_text(runs[first], head + match.group(0))
+        for i in range(first + 1, last):
+            _set_run_text(runs[i], "")
+        _set_run_text(runs[last], tail)
+
+    for r in p.iter(qn("w:r")):
+        for t in r.iter(qn("w:t")):
+            if t.text and _PLACEHOLDER_RE.search(t.text):
+                # Подставленные значения могут начинаться или кончаться пробелом
+                t.set(qn("xml:space"), "preserve")
+
+
+def _run_at(offsets, texts, position):
+    for i in range(len(texts) - 1, -1, -1):
+        if texts[i] and offsets[i] <= position:
+            return i
+    return 0
+
+
+def _set_run_text(r, text):
+    from docx.oxml.ns import qn
+
+    ts = list(r.iter(qn("w:t")))
+    if not ts:
+        return
+    ts[0].text = text
+    for t in ts[1:]:
+        t.getparent().remove(t)
+
+
+def _xml_text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return escape(str(value)).replace("\n", _LINE_BREAK)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(path=TEMPLATE_PATH):
+    """Скомпилированный шаблон; пересобирается только при изменении файла."""
+    mtime = os.path.getmtime(path)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _templates[path] = (mtime, ActTemplate(path))
+        return cached[1]
+
+
+def act_file_name(record):
+    return f"Акт_{record['id']}.docx"
+
+
+def render_act(record, path=TEMPLATE_PATH):
+    return get_template(path).render(record)
+
+
+def _render_chunk(path, records):
+    # Выполняется в процессе пула; шаблон компилируется там один раз
+    template = get_template(path)
+    return [(act_file_name(record), template.render(record)) for record in records]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, а не fork: сервер Streamlit многопоточный, и форк
+            # может унаследовать захваченные другими потоками блокировки.
+            # Процесс пула при старте выполняет скрипт Streamlit (app.py)
+            # как __mp_main__: определения и импорты там выполняются, а
+            # интерфейс, миграции и очистка фото стоят под проверкой
+            # __name__ == "__main__" и не запускаются
+            _pool = ProcessPoolExecutor(
+                max_workers=ACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_acts_zip(records, path=TEMPLATE_PATH, progress=None):
+    """Акты для всех записей одним ZIP-архивом (BytesIO).
+
+    Большие пакеты раздаются порциями в пул процессов; готовые акты
+    дописываются в архив по мере завершения порций. `progress(done, total)`
+    вызывается в текущем потоке после каждой порции.
+    """
+    records = list(records)
+    path = os.path.abspath(path)
+    total = len(records)
+    chunks = [records[i:i + ACT_CHUNK_SIZE] for i in range(0, total, ACT_CHUNK_SIZE)]
+
+    buffer = io.BytesIO()
+    done = 0
+    # docx уже сжат, повторно его не сжимаем
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        if ACT_WORKERS > 1 and total >= PARALLEL_MIN_RECORDS:
+            try:
+                futures = [_get_pool().submit(_render_chunk, path, chunk) for chunk in chunks]
+                finished = (future.result() for future in as_completed(futures))
+            except BrokenProcessPool:
+                _reset_pool()
+                raise
+        else:
+            finished = (_render_chunk(path, chunk) for chunk in chunks)
+
+        try:
+            for documents in finished:
+                for name, data in documents:
+                    zf.writestr(name, data)
+                done += len(documents)
+                if progress:
+                    progress(done, total)
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
+    buffer.seek(0)
+    return buffer
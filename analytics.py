@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from db import DATE_FORMAT
+
+# --------------------------
+# Показатели проверок в СП
+# --------------------------
+
+# Шаг группировки по времени: неделя с понедельника или календарный месяц
+FREQUENCIES = {
+    "Неделя": dict(freq="W-MON", label="left", closed="left"),
+    "Месяц": dict(freq="MS"),
+}
+
+# Суммируемые величины и относительные показатели (столбец -> подпись)
+SUM_COLUMNS = ["records", "checks_count", "violations_count", "person_hours", "kpb_detected"]
+RATE_COLUMNS = {
+    "violations_per_100_checks": "Нарушений на 100 проверок",
+    "violations_per_person_hour": "Нарушений на чел.-час",
+    "kpb_rate": "Записей с нарушением КПБ, %",
+}
+
+
+def shift_hours(start, end):
+    """Длительность работ в часах по столбцам времени ЧЧ:ММ.
+
+    Окончание раньше начала означает работу через полночь.
+    """
+    start = pd.to_datetime(start, format="%H:%M", errors="coerce")
+    end = pd.to_datetime(end, format="%H:%M", errors="coerce")
+    hours = (end - start).dt.total_seconds() / 3600
+    return hours.where(hours >= 0, hours + 24)
+
+
+def checks_sums(df, frequency, by=("po_id", "sp_id")):
+    """Суммы по периодам и разрезам `by` за один проход по строкам checks.
+
+    `df` — строки checks со столбцами date, start_time, end_time,
+    personnel_count, checks_count, violations_count, kpb_detected и
+    столбцами из `by`; `frequency` — ключ FREQUENCIES. Индекс результата:
+    (date — начало периода, *by).
+    """
+    df = df.assign(
+        date=pd.to_datetime(df["date"], format=DATE_FORMAT, errors="coerce"),
+        person_hours=shift_hours(df["start_time"], df["end_time"]) * df["personnel_count"],
+        records=1,
+    )
+    grouper = pd.Grouper(key="date", **FREQUENCIES[frequency])
+    return df.groupby([grouper, *by])[SUM_COLUMNS].sum()
+
+
+def rates(sums, levels):
+    """Суммы и показатели из `checks_sums`, свёрнутые до уровней `levels`.
+
+    Деление на ноль (нет проверок или чел.-часов) даёт NaN.
+    """
+    sums = sums.groupby(level=levels).sum()
+    checks = sums["checks_count"].replace(0, np.nan)
+    person_hours = sums["person_hours"].replace(0, np.nan)
+    return sums.assign(
+        violations_per_100_checks=100 * sums["violations_count"] / checks,
+        violations_per_person_hour=sums["violations_count"] / person_hours,
+        kpb_rate=100 * sums["kpb_detected"] / sums["records"],
+    )
+
+
+# --------------------------
+# Матрицы проверок ОТиПБ
+# --------------------------
+
+def matrix(counts, row_names, column_names):
+    """Таблица сопряжённости из счётчиков по парам кодов.
+
+    `counts` — столбцы row_code, column_code, n (результат GROUP BY по
+    кодам справочников). Строки и столбцы идут в порядке справочников
+    `row_names`/`column_names` ({код: значение}); столбцы показываются
+    все, строки — только встретившиеся.
+    """
+    table = counts.pivot_table(index="row_code", columns="column_code", values="n",
+                               aggfunc="sum", fill_value=0)
+    table = table.reindex(index=[code for code in row_names if code in table.index],
+                          columns=list(column_names), fill_value=0)
+    return table.rename(index=row_names, columns=column_names)
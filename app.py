@@ -1,14 +1,21 @@
 import streamlit as st
 import sqlite3
-import pandas as pd
-from datetime import datetime, time
-from docx import Document
+from datetime import datetime, time, timedelta
 import io
+import json
 import os
-import uuid
-import matplotlib.pyplot as plt
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as OpenpyxlImage
+
+# pandas, analytics (pandas/NumPy) и openpyxl импортируются внутри функций
+# модулей: главное меню и холодный старт без них заметно быстрее. acts,
+# charts, export и photo_store сами откладывают импорт python-docx,
+# matplotlib, openpyxl и Pillow до первого использования
+# (замер: python startup_benchmark.py)
+import acts
+import charts
+import db
+import export
+import photo_store
+from db import DATABASE_NAME, COMMON_DB, SOFTWARE_DB
 
 
 
@@ -21,52 +28,74 @@ st.set_page_config(
 
 
 # Общие настройки
-DATABASE_NAME = "inspections.db"
-COMMON_DB = "common.db"
-SOFTWARE_DB = "software_checks.db"
-UPLOAD_FOLDER = "uploads"
+UPLOAD_FOLDER = photo_store.UPLOAD_FOLDER
+PAGE_SIZES = [25, 50, 100, 200]  # Варианты размера страницы таблиц
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+
+# Миграции схемы выполняются один раз на процесс, а не на каждый rerun
+@st.cache_resource
+def init_databases():
+    db.migrate_all()
+
+
+# Фоновая очистка осиротевших фото: один поток на процесс сервера
+@st.cache_resource
+def start_photo_gc():
+    return photo_store.start_gc_thread()
+
+
+# Процессы пула актов (spawn) выполняют этот скрипт как __mp_main__;
+# миграции и очистка фото запускаются только в процессе сервера
+if __name__ == "__main__":
+    init_databases()
+    start_photo_gc()
+
 # --------------------------
 # Общие функции для работы с организациями
 # --------------------------
 
-def init_common_db():
-    conn = sqlite3.connect(COMMON_DB)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS organizations
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT UNIQUE)''')
-    conn.commit()
-    conn.close()
-
 def add_organization(name):
-    conn = sqlite3.connect(COMMON_DB)
     try:
-        c = conn.cursor()
-        c.execute("INSERT INTO organizations (name) VALUES (?)", (name,))
-        conn.commit()
+        with db.transaction(COMMON_DB, invalidates=["organizations"]) as c:
+            c.execute("INSERT INTO organizations (name) VALUES (?)", (name,))
     except sqlite3.IntegrityError:
         raise ValueError("Организация с таким названием уже существует")
-    finally:
-        conn.close()
 
 def get_organizations():
-    conn = sqlite3.connect(COMMON_DB)
-    c = conn.cursor()
-    c.execute("SELECT name FROM organizations ORDER BY name")
-    organizations = [row[0] for row in c.fetchall()]
-    conn.close()
-    return organizations
+    return list(get_organization_names().values())
 
-def delete_organization(name):
-    conn = sqlite3.connect(COMMON_DB)
-    c = conn.cursor()
-    c.execute("DELETE FROM organizations WHERE name=?", (name,))
-    conn.commit()
-    conn.close()
+def get_organization_names():
+    # {id: название} в алфавитном порядке; записи модулей хранят id
+    rows = db.fetch_all(COMMON_DB, "SELECT id, name FROM organizations ORDER BY name",
+                        tables=["organizations"])
+    return dict(rows)
+
+# Таблица справочника для кэша запросов из других баз
+ORGANIZATIONS_TABLE = (COMMON_DB, "organizations")
+
+def organization_name(column):
+    # Название организации по ссылке `column` в SELECT к другой базе
+    return (f"(SELECT o.name FROM {db.SCHEMAS[COMMON_DB]}.organizations o "
+            f"WHERE o.id = {column})")
 
-# Обновление организации
+def delete_organization(name):
+    with db.transaction(COMMON_DB, invalidates=["organizations"]) as c:
+        c.execute("SELECT id FROM organizations WHERE name=?", (name,))
+        row = c.fetchone()
+        if row is None:
+            return
+        c.execute(f'''SELECT (SELECT COUNT(*) FROM {db.SCHEMAS[DATABASE_NAME]}.inspections
+                            WHERE organization_id = ?) +
+                           (SELECT COUNT(*) FROM {db.SCHEMAS[SOFTWARE_DB]}.checks
+                            WHERE po_id = ?)''', (row[0], row[0]))
+        used = c.fetchone()[0]
+        if used:
+            raise ValueError(f"Организация используется в записях ({used}), удалить её нельзя")
+        c.execute("DELETE FROM organizations WHERE id=?", (row[0],))
+
+# Обновление организации: записи ссылаются на id, поэтому
+# переименование меняет одну строку справочника
 def update_organization(old_name, new_name):
     if not old_name or not new_name:
         raise ValueError("Название организации не может быть пустым.")
@@ -74,57 +103,86 @@ def update_organization(old_name, new_name):
     if old_name == new_name:
         raise ValueError("Новое название должно отличаться от старого.")
     
-    conn = sqlite3.connect(COMMON_DB)
-    c = conn.cursor()
     try:
-        c.execute("SELECT name FROM organizations WHERE name = ?", (new_name,))
-        if c.fetchone():
-            raise ValueError(f"Организация с названием '{new_name}' уже существует.")
-        
-        c.execute("UPDATE organizations SET name = ? WHERE name = ?", (new_name, old_name))
-        conn.commit()
+        with db.transaction(COMMON_DB, invalidates=["organizations"]) as c:
+            c.execute("SELECT name FROM organizations WHERE name = ?", (new_name,))
+            if c.fetchone():
+                raise ValueError(f"Организация с названием '{new_name}' уже существует.")
+
+            c.execute("UPDATE organizations SET name = ? WHERE name = ?", (new_name, old_name))
     except sqlite3.Error as e:
         raise ValueError(f"Ошибка при обновлении организации: {e}")
-    finally:
-        conn.close()
+
+
+# --------------------------
+# Справочники значений
+# --------------------------
+
+# Повторяющиеся значения (объекты, типы нарушений, ФИО и т.п.) хранятся
+# в common.lookups, а в записях — только их коды
+LOOKUPS_TABLE = (COMMON_DB, "lookups")
+
+def get_lookup(kind):
+    # {код: значение} в порядке показа в выпадающем списке
+    rows = db.fetch_all(
+        COMMON_DB,
+        "SELECT id, value FROM lookups WHERE kind = ? ORDER BY position IS NULL, position, id",
+        (kind,), tables=["lookups"])
+    return dict(rows)
+
+def lookup_value(column):
+    # Значение справочника по коду `column` в SELECT к другой базе
+    return (f"(SELECT l.value FROM {db.SCHEMAS[COMMON_DB]}.lookups l "
+            f"WHERE l.id = {column})")
+
+def select_code(container, label, names, all_label=None, exclude=(), key=None):
+    # Выпадающий список по словарю {код: значение}, возвращает код;
+    # с all_label первым идёт пункт «все» (None)
+    options = [code for code, name in names.items() if name not in exclude]
+    if all_label:
+        return container.selectbox(label, [None] + options,
+                                   format_func=lambda x: names.get(x, all_label), key=key)
+    return container.selectbox(label, options, format_func=names.get, key=key)
 
         
 def get_record_by_id(record_id):
-    conn = sqlite3.connect(SOFTWARE_DB)
-    c = conn.cursor()
-    c.execute("SELECT * FROM checks WHERE id=?", (record_id,))
-    record = c.fetchone()
-    conn.close()
+    # Запись и пути её фото одним запросом по первичному ключу; кэшируется
+    # по ID до следующей записи в checks или photos
+    record = db.fetch_record(
+        SOFTWARE_DB,
+        f"""SELECT r.*,
+                   (SELECT json_group_array(file_path) FROM photos
+                    WHERE record_id = r.id) AS photos
+            FROM ({CHECKS_SELECT} WHERE id=?) r""",
+        (record_id,), tables=CHECKS_TABLES + ["photos"])
+    if record is not None:
+        record["photos"] = json.loads(record["photos"])
     return record
 
 
 def update_record(data):
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
         try:
-            c.execute('''UPDATE checks SET
-                 date=?,
-                 sp_name=?,
-                 responsible=?,
-                 po_name=?,
-                 object=?,
-                 works_count=?,
-                 responsibility_zone=?,
-                 start_time=?,
-                 end_time=?,
-                 personnel_count=?,
-                 checks_count=?,
-                 violations_count=?,
-                 violation_type=?,
-                 kpb_violation=?,
-                 kpb_detected=?,
-                 act_issued=?
-                 WHERE id=?''', data)
-            conn.commit()
+            with db.transaction(SOFTWARE_DB, invalidates=["checks"]) as c:
+                c.execute('''UPDATE checks SET
+                     date=?,
+                     sp_id=?,
+                     responsible_id=?,
+                     po_id=?,
+                     object_id=?,
+                     works_count=?,
+                     zone_id=?,
+                     start_time=?,
+                     end_time=?,
+                     personnel_count=?,
+                     checks_count=?,
+                     violations_count=?,
+                     violation_type_id=?,
+                     kpb_violation_id=?,
+                     kpb_detected=?,
+                     act_issued=?
+                     WHERE id=?''', data)
         except sqlite3.Error as e:
             raise ValueError(f"Ошибка при обновлении записи: {e}")
-        finally:
-            conn.close()
         
 # --------------------------
 # Главное меню
@@ -168,94 +226,354 @@ def main_menu():
 # Модуль 1: Проверки ОТиПБ
 # --------------------------
 
+NO_VIOLATIONS = "Нарушений не выявлено"  # Есть только в проверках СП
+OPEN_STATUS = "не устранено"
+CLOSED_STATUS = "устранено"
+# Столбцы записей в порядке показа; организация и справочные значения
+# хранятся кодами
+INSPECTIONS_SELECT = f'''SELECT id, inspection_date,
+                               {lookup_value("object_id")} AS object,
+                               {lookup_value("section_id")} AS section,
+                               {organization_name("organization_id")} AS organization,
+                               violator_name, violation_description,
+                               {lookup_value("violation_type_id")} AS violation_type,
+                               {lookup_value("violation_category_id")} AS violation_category,
+                               {lookup_value("risk_level_id")} AS risk_level,
+                               {lookup_value("inspector_id")} AS inspector_name,
+                               elimination_date,
+                               {lookup_value("elimination_status_id")} AS elimination_status,
+                               photo_path
+                        FROM inspections'''
+INSPECTIONS_TABLES = ["inspections", ORGANIZATIONS_TABLE, LOOKUPS_TABLE]
+# Столбцы выборки со значениями справочников и их виды
+INSPECTIONS_LOOKUPS = {
+    "object": "inspection_object",
+    "section": "section",
+    "violation_type": "violation_type",
+    "violation_category": "violation_category",
+    "risk_level": "risk_level",
+    "inspector_name": "inspector",
+    "elimination_status": "elimination_status",
+}
+# Столбцы inspections с кодами для столбцов выборки
+INSPECTIONS_CODES = {
+    "object": "object_id",
+    "section": "section_id",
+    "organization": "organization_id",
+    "violation_type": "violation_type_id",
+    "violation_category": "violation_category_id",
+    "risk_level": "risk_level_id",
+    "inspector_name": "inspector_id",
+    "elimination_status": "elimination_status_id",
+}
+INSPECTIONS_DATES = ["inspection_date", "elimination_date"]
+# Столбцы, которые можно править прямо в таблице
+INSPECTIONS_EDITABLE = INSPECTIONS_DATES + ["violator_name", "violation_description"] + list(INSPECTIONS_CODES)
+
+def get_inspection(record_id):
+    # Одна запись по первичному ключу вместо поиска по кадру страницы;
+    # кэшируется по ID до следующей записи в inspections
+    return db.fetch_record(DATABASE_NAME, f"{INSPECTIONS_SELECT} WHERE id=?",
+                           (record_id,), tables=INSPECTIONS_TABLES)
+
 def module1():
+    import pandas as pd
+
+    import analytics
+
     st.title("📋 Управление проверками ОТиПБ")
 
     # Функции БД
-    def create_db():
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS inspections
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      inspection_date TEXT,
-                      object TEXT,
-                      section TEXT,
-                      organization TEXT,
-                      violator_name TEXT,
-                      violation_description TEXT,
-                      violation_type TEXT,
-                      violation_category TEXT,
-                      risk_level TEXT,
-                      inspector_name TEXT,
-                      elimination_date TEXT,
-                      elimination_status TEXT,
-                      photo_path TEXT)''')
-        conn.commit()
-        conn.close()
-
-    def add_to_db(data):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''INSERT INTO inspections VALUES 
-                  (NULL,?,?,?,?,?,?,?,?,?,?,?,?,?)''', data)
-        conn.commit()
-        conn.close()
-
-    def get_all_data():
-        conn = sqlite3.connect(DATABASE_NAME)
-        df = pd.read_sql('SELECT * FROM inspections', conn)
-        conn.close()
-        return df
-
-    def update_db(data):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''UPDATE inspections SET
-                  inspection_date=?,
-                  object=?,
-                  section=?,
-                  organization=?,
-                  violator_name=?,
-                  violation_description=?,
-                  violation_type=?,
-                  violation_category=?,
-                  risk_level=?,
-                  inspector_name=?,
-                  elimination_date=?,
-                  elimination_status=?,
-                  photo_path=?
-                  WHERE id=?''', data)
-        conn.commit()
-        conn.close()
+    def add_to_db(data, uploaded_photo=None):
+        # Если запись не сохранилась, файл фото удаляется
+        try:
+            with photo_store.staged([uploaded_photo] if uploaded_photo else []) as photo_paths, \
+                 db.transaction(DATABASE_NAME, invalidates=["inspections"]) as c:
+                photo_path = photo_paths[0] if photo_paths else None
+                c.execute('''INSERT INTO inspections
+                          (inspection_date, object_id, section_id, organization_id, violator_name,
+                           violation_description, violation_type_id, violation_category_id,
+                           risk_level_id, inspector_id, elimination_date, elimination_status_id,
+                           photo_path)
+                          VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)''', data + (photo_path,))
+        except (sqlite3.Error, OSError) as e:
+            raise ValueError(f"Ошибка при сохранении записи: {e}")
+
+    def get_page(filters, cursor=None, page_size=50):
+        # Keyset-пагинация: следующая страница начинается строго после
+        # (inspection_date, id) последней строки предыдущей, без OFFSET
+        clauses, params = db.build_where(filters, "inspection_date")
+        if cursor is not None:
+            clauses.append("(inspection_date, id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return db.read_frame(
+            DATABASE_NAME,
+            f"{INSPECTIONS_SELECT} {where} "
+            "ORDER BY inspection_date DESC, id DESC LIMIT ?",
+            params + [page_size + 1], tables=INSPECTIONS_TABLES)
+
+    def get_all_data(filters):
+        # Курсор, а не DataFrame: строки читаются по мере выгрузки
+        # (использовать в блоке with)
+        clauses, params = db.build_where(filters, "inspection_date")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return db.stream(
+            DATABASE_NAME,
+            f"{INSPECTIONS_SELECT} {where} ORDER BY inspection_date DESC, id DESC",
+            params)
+
+    def get_max_id():
+        return db.fetch_one(DATABASE_NAME, "SELECT MAX(id) FROM inspections",
+                            tables=["inspections"])[0]
+
+    def update_db(changes):
+        # changes — {id: {столбец inspections: значение}}: обновляются только
+        # изменённые столбцы, все записи одной транзакцией
+        try:
+            with db.transaction(DATABASE_NAME, invalidates=["inspections"]) as c:
+                db.update_rows(c, "inspections", changes)
+        except sqlite3.Error as e:
+            raise ValueError(f"Ошибка при обновлении записей: {e}")
+
+    def get_matrix(row_column, column_column, date_from, date_to):
+        # Число проверок по парам кодов за период; названия подставляются
+        # уже в готовую таблицу
+        return db.read_frame(
+            DATABASE_NAME,
+            f"SELECT {row_column} AS row_code, {column_column} AS column_code, COUNT(*) AS n "
+            "FROM inspections WHERE inspection_date BETWEEN ? AND ? GROUP BY 1, 2",
+            (date_from, date_to), tables=["inspections"])
+
+    def get_overdue(today):
+        # Неустранённые нарушения с прошедшим сроком: поиск по индексу
+        # (elimination_status_id, elimination_date), а не фильтр всей таблицы
+        open_code = {name: code for code, name in get_lookup("elimination_status").items()}.get(OPEN_STATUS)
+        return db.read_frame(
+            DATABASE_NAME,
+            f"{INSPECTIONS_SELECT} WHERE elimination_status_id = ? AND elimination_date < ? "
+            "ORDER BY elimination_date",
+            (open_code, today), tables=INSPECTIONS_TABLES)
+
+    def close_overdue(organization_id, today):
+        # Все просроченные неустранённые нарушения организации (без неё —
+        # всех организаций) одним UPDATE по индексу статуса и срока
+        statuses = {name: code for code, name in get_lookup("elimination_status").items()}
+        clauses, params = db.build_where({"organization_id": organization_id}, "inspection_date")
+        with db.transaction(DATABASE_NAME, invalidates=["inspections"]) as c:
+            c.execute(
+                "UPDATE inspections SET elimination_status_id = ? "
+                "WHERE elimination_status_id = ? AND elimination_date < ?"
+                + "".join(f" AND {clause}" for clause in clauses),
+                [statuses[CLOSED_STATUS], statuses[OPEN_STATUS], today] + params)
+            return c.rowcount
 
     def delete_from_db(record_id):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT photo_path FROM inspections WHERE id=?', (record_id,))
-        result = c.fetchone()
-        if result and result[0] and os.path.exists(result[0]):
-            os.remove(result[0])
-        c.execute('DELETE FROM inspections WHERE id=?', (record_id,))
-        conn.commit()
-        conn.close()
+        with db.transaction(DATABASE_NAME, invalidates=["inspections"]) as c:
+            c.execute('SELECT photo_path FROM inspections WHERE id=?', (record_id,))
+            result = c.fetchone()
+            c.execute('DELETE FROM inspections WHERE id=?', (record_id,))
+        # Файл удаляется, только если на него больше никто не ссылается
+        if result:
+            photo_store.release([result[0]])
+
+    def get_changes(before, after, organizations):
+        # Правки таблицы: сравнение отредактированной страницы с загруженной,
+        # значения справочников переводятся обратно в коды
+        codes = {column: {name: code for code, name in get_lookup(kind).items()}
+                 for column, kind in INSPECTIONS_LOOKUPS.items()}
+        codes["organization"] = {name: code for code, name in organizations.items()}
+        changes = {}
+        for column in INSPECTIONS_EDITABLE:
+            old, new = before[column].astype(object), after[column].astype(object)
+            if column in INSPECTIONS_DATES:
+                old, new = pd.to_datetime(old), pd.to_datetime(new)
+            changed = ~((old == new) | (old.isna() & new.isna()))
+            for record_id, value in zip(after.loc[changed, "id"], new[changed]):
+                if pd.isna(value):
+                    value = None
+                elif column in INSPECTIONS_DATES:
+                    value = value.strftime(db.DATE_FORMAT)
+                elif column in codes:
+                    value = codes[column][value]
+                changes.setdefault(int(record_id), {})[INSPECTIONS_CODES.get(column, column)] = value
+        return changes
+
+    # Фрагменты страницы: виджеты внутри фрагмента перезапускают только
+    # его, а не весь модуль с выборкой таблицы и формами
+    @st.fragment
+    def page_table(df, organizations):
+        # В таблице — миниатюры, а не исходные файлы
+        table_df = df.assign(
+            photo_path=df["photo_path"].map(photo_store.thumbnail_data_uri),
+            **{column: pd.to_datetime(df[column], format=db.DATE_FORMAT, errors="coerce")
+               for column in INSPECTIONS_DATES})
+        # Ключ меняется со страницей и после сохранения: правки прежней
+        # страницы не переносятся на новые строки
+        version = (tuple(df["id"]), db.data_version(DATABASE_NAME, ["inspections"]))
+        edited = st.data_editor(
+            table_df,
+            key=f"m1_editor_{hash(version)}",
+            column_config={
+                "photo_path": st.column_config.ImageColumn(
+                    "Фото",
+                    help="Загруженные изображения"
+                ),
+                # Без даты запись выпала бы из keyset-пагинации по дате
+                **{column: st.column_config.DateColumn(column, format="DD.MM.YYYY", required=True)
+                   for column in INSPECTIONS_DATES},
+            },
+            hide_index=True,
+            use_container_width=True,
+            disabled=[column for column in df.columns if column not in INSPECTIONS_EDITABLE]
+        )
+
+        changes = get_changes(table_df, edited, organizations)
+        if st.button(f"💾 Сохранить изменения ({len(changes)})", disabled=not changes):
+            try:
+                update_db(changes)
+                st.success("Изменения сохранены!")
+                st.rerun()  # Вся страница: порядок и фильтры могли измениться
+            except ValueError as e:
+                st.error(str(e))
+
+    @st.fragment
+    def record_panel(max_id, filters):
+        # Управление записями
+        cols = st.columns(5)
+        selected_id = cols[0].number_input(
+            "Введите ID записи", 
+            min_value=1,
+            max_value=max_id
+        )
+        
+        if cols[1].button("🗑️ Удалить запись"):
+            delete_from_db(selected_id)
+            st.success("Запись удалена!")
+            st.rerun()  # Вся страница: таблица изменилась
+            
+        if cols[2].button("📥 Экспорт в Excel"):
+            # Выгружаем все записи по текущим фильтрам, а не только страницу
+            with get_all_data(filters) as rows:
+                output = export.write_xlsx(
+                    rows,
+                    [column[0] for column in rows.description],
+                    date_columns=["inspection_date", "elimination_date"])
+
+            # Предлагаем пользователю скачать файл
+            st.download_button(
+                label="⬇️ Скачать Excel",
+                data=output,
+                file_name='inspections.xlsx',
+                mime=export.XLSX_MIME)
+    
+
+        
+        record = get_inspection(selected_id) if selected_id else None
+
+        if cols[3].button("📄 Сформировать акт"):
+            if record is None:
+                st.warning("Запись с таким ID не найдена")
+            else:
+                record = dict(record, **{
+                    column: format_date(record[column])
+                    for column in ("inspection_date", "elimination_date")})
+                doc_buffer = generate_act(record)
+                if doc_buffer:
+                    st.download_button(
+                        label="⬇️ Скачать акт",
+                        data=doc_buffer,
+                        file_name=acts.act_file_name(record),
+                        mime=acts.DOCX_MIME
+                    )
+
+        if cols[4].button("📦 Акты по фильтру", help="Акты по всем записям, отобранным фильтрами, одним ZIP-архивом"):
+            with get_all_data(filters) as rows:
+                records = pd.DataFrame.from_records(rows, columns=[column[0] for column in rows.description])
+            if records.empty:
+                st.warning("Нет записей, соответствующих фильтрам")
+            else:
+                format_dates(records, ["inspection_date", "elimination_date"])
+                zip_buffer = generate_acts_zip(records.to_dict("records"))
+                if zip_buffer:
+                    st.download_button(
+                        label=f"⬇️ Скачать акты ({len(records)})",
+                        data=zip_buffer,
+                        file_name="Акты.zip",
+                        mime=acts.ZIP_MIME
+                    )
+        
+        # Просмотр фото
+        if record is not None:
+            photo_path = record['photo_path']
+            if isinstance(photo_path, str) and os.path.exists(photo_path):
+                st.image(photo_store.thumbnail_path(photo_path), caption="Прикрепленное фото", width=300)
+                if st.button("🔍 Открыть фото"):
+                    show_full_photo(photo_path)
+            else:
+                st.warning("Для этой записи нет прикрепленного фото")
+
+    @st.fragment
+    def analytics_panel(organizations):
+        with st.expander("📈 Аналитика"):
+            cols = st.columns(2)
+            matrix_from = cols[0].date_input("Начало периода", datetime.today() - timedelta(days=90),
+                                             format="DD.MM.YYYY", key="m1_matrix_from")
+            matrix_to = cols[1].date_input("Конец периода", datetime.today(),
+                                           format="DD.MM.YYYY", key="m1_matrix_to")
+            period = (matrix_from.strftime(db.DATE_FORMAT), matrix_to.strftime(db.DATE_FORMAT))
+
+            st.markdown("**Объект × тип нарушения**")
+            table = analytics.matrix(get_matrix("object_id", "violation_type_id", *period),
+                                     get_lookup("inspection_object"),
+                                     {code: name for code, name in get_lookup("violation_type").items()
+                                      if name != NO_VIOLATIONS})
+            st.dataframe(table.style.background_gradient(cmap="Reds", axis=None),
+                         use_container_width=True)
+
+            st.markdown("**Организация × уровень риска**")
+            table = analytics.matrix(get_matrix("organization_id", "risk_level_id", *period),
+                                     organizations, get_lookup("risk_level"))
+            st.dataframe(table.style.background_gradient(cmap="Reds", axis=None),
+                         use_container_width=True)
+
+            # Просрочки не зависят от периода: срок мог пройти у давней проверки
+            today = datetime.today().date()
+            overdue = get_overdue(today.strftime(db.DATE_FORMAT))
+            st.markdown(f"**Просроченные неустранённые нарушения: {len(overdue)}**")
+            if not overdue.empty:
+                overdue.insert(0, "days_overdue", (
+                    pd.Timestamp(today) - pd.to_datetime(overdue["elimination_date"], format=db.DATE_FORMAT)
+                ).dt.days)
+                format_dates(overdue, ["inspection_date", "elimination_date"])
+                st.dataframe(overdue.drop(columns=["photo_path"]), hide_index=True,
+                             use_container_width=True)
+
+    @st.fragment
+    def bulk_panel(organizations):
+        with st.expander("🧹 Массовые операции"):
+            cols = st.columns([2, 1])
+            organization = select_code(cols[0], "Организация", organizations, "Все",
+                                       key="m1_bulk_organization")
+            if cols[1].button("✅ Закрыть просроченные",
+                              help=f"Статус «{CLOSED_STATUS}» всем нарушениям со статусом «{OPEN_STATUS}» и прошедшим сроком"):
+                try:
+                    count = close_overdue(organization, datetime.today().strftime(db.DATE_FORMAT))
+                    st.success(f"Закрыто нарушений: {count}")
+                    st.rerun()  # Вся страница: таблица изменилась
+                except (KeyError, sqlite3.Error) as e:
+                    st.error(f"Ошибка при обновлении записей: {e}")
 
     # Форма добавления записи
-    create_db()
     with st.expander("➕ Добавить новую запись", expanded=True):
         with st.form("add_form", clear_on_submit=True):
             cols = st.columns(2)
             inspection_date = cols[0].date_input("Дата проверки*", datetime.today())
-            object_val = cols[1].selectbox(
-                "Объект проверки*",
-                ["УТЭЦ-2", "АНГЦ-5", "Стан 2000", "КЦ-1", "КЦ-2", "АТУ", "ДЦ-1", "ДЦ-2","ЦХПП","ЦГП","УЖДТ"]
-            )
+            object_val = select_code(cols[1], "Объект проверки*", get_lookup("inspection_object"))
             
-            section = cols[0].selectbox("Участок проверки*", ["Участок монтажа м\к","Сварочный участок","Участок установки оборудования","Ось 11-3","Отметка +45.100","Маслоподвал"])
-            organization = cols[1].selectbox(
-                "Наименование организации*", 
-                get_organizations(),
-                index=0
-            )
+            section = select_code(cols[0], "Участок проверки*", get_lookup("section"))
+            organizations = get_organization_names()
+            organization = select_code(cols[1], "Наименование организации*", organizations)
             
             cols_v = st.columns(2)
             violator_name = cols_v[0].text_input("ФИО Нарушителя*")
@@ -263,40 +581,24 @@ def module1():
 
             
             cols2 = st.columns(2)
-            violation_type = cols2[0].selectbox(
-                "Тип нарушения*", [
-                "Работы на высоте", "Огневые работы/Пожарная безопасность", 
-                "Грузоподъёмные работы/Работа с ПС", "Электробезопасность", 
-                "Работы в газоопасн. местах/замкнутом простр-ве", 
-                "Земляные работы", "Документы/Допуски и удостоверения", 
-                "Исправность инструментов и приспособлений", 
-                "Применение/Исправность СИЗ", 
-                "Содержание территории/рабочих мест", 
-                "Безопасность дорожного движения"])
+            violation_type = select_code(
+                cols2[0], "Тип нарушения*", get_lookup("violation_type"),
+                exclude=[NO_VIOLATIONS])
             
             
             # Второй выпадающий список
-            violation_category = cols2[1].selectbox("Категория нарушения*", ["Применение СИЗ", "Обучение и аттестации", "ППР", "Леса", "Анкерные линии", "Другое"])
+            violation_category = select_code(cols2[1], "Категория нарушения*", get_lookup("violation_category"))
             
 
             cols3 = st.columns(3)
-            risk_level = cols3[1].selectbox(
-                "Уровень риска*", 
-                ["высокий", "средний", "низкий"]
-            )
+            risk_level = select_code(cols3[1], "Уровень риска*", get_lookup("risk_level"))
             
-            inspector_name = cols_v[0].selectbox(
-                "Проверяющий*", 
-                ["Супервайзер ИТК Иванов И.И.", "Специалист ОТиПБ Петров П.П.", "Специалист ОТ ПО Сидоров С.С."]
-            )
+            inspector_name = select_code(cols_v[0], "Проверяющий*", get_lookup("inspector"))
             elimination_date = cols3[2].date_input(
                 "Дата устранения*", 
                 datetime.today()
             )
-            elimination_status = cols3[0].selectbox(
-                "Статус устранения*", 
-                ["не устранено", "устранено"]
-            )
+            elimination_status = select_code(cols3[0], "Статус устранения*", get_lookup("elimination_status"))
             
             uploaded_photo = st.file_uploader(
                 "Загрузить фото нарушения",
@@ -305,9 +607,8 @@ def module1():
             )
             
             if st.form_submit_button("💾 Сохранить запись"):
-                photo_path = save_uploaded_file(uploaded_photo)
                 data = (
-                    inspection_date.strftime("%d.%m.%Y"),
+                    inspection_date.strftime(db.DATE_FORMAT),
                     object_val,
                     section,
                     organization,
@@ -317,184 +618,143 @@ def module1():
                     violation_category,
                     risk_level,
                     inspector_name,
-                    elimination_date.strftime("%d.%m.%Y"),
-                    elimination_status,
-                    photo_path
+                    elimination_date.strftime(db.DATE_FORMAT),
+                    elimination_status
                 )
-                add_to_db(data)
-                st.success("Запись успешно сохранена!")
-                st.rerun()
+                try:
+                    add_to_db(data, uploaded_photo)
+                    st.success("Запись успешно сохранена!")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
 
     # Таблица данных
     st.subheader("📊 Список проверок")
-    df = get_all_data()
-    
-    if not df.empty:
-        edited_df = st.data_editor(
-            df,
-            column_config={
-                "photo_path": st.column_config.ImageColumn(
-                    "Фото",
-                    help="Загруженные изображения"
-                )
-            },
-            hide_index=True,
-            use_container_width=True,
-            disabled=df.columns.tolist()
-        )
-        
-        # Управление записями
+    with st.expander("🔎 Фильтры"):
         cols = st.columns(4)
-        selected_id = cols[0].number_input(
-            "Введите ID записи", 
-            min_value=1,
-            max_value=df['id'].max()
-        )
-        
-        if cols[1].button("🗑️ Удалить запись"):
-            delete_from_db(selected_id)
-            st.success("Запись удалена!")
-            st.rerun()
-            
-        if cols[2].button("📥 Экспорт в Excel"):
-            # Создаем новый Excel-файл
-            wb = Workbook()
-            ws = wb.active
-            # Заголовки столбцов
-            ws.append(df.columns.tolist())
-    
-            # Данные
-            for row in df.itertuples(index=False):
-                ws.append(row)
-    
-            # Сохраняем файл в буфер
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
+        filters = {
+            "object_id": select_code(cols[0], "Объект", get_lookup("inspection_object"), "Все"),
+            "organization_id": select_code(cols[1], "Организация", organizations, "Все"),
+            "risk_level_id": select_code(cols[2], "Уровень риска", get_lookup("risk_level"), "Все"),
+            "elimination_status_id": select_code(cols[3], "Статус устранения", get_lookup("elimination_status"), "Все"),
+        }
+        cols = st.columns(3)
+        filters["date_from"] = cols[0].date_input("Дата проверки с", value=None, format="DD.MM.YYYY")
+        filters["date_to"] = cols[1].date_input("Дата проверки по", value=None, format="DD.MM.YYYY")
+        page_size = cols[2].selectbox("Записей на странице", PAGE_SIZES, index=1)
+
+    # Курсоры начала страниц; при смене фильтров листаем с начала
+    filters_key = (tuple(filters.items()), page_size)
+    if st.session_state.get("m1_filters_key") != filters_key:
+        st.session_state.m1_filters_key = filters_key
+        st.session_state.m1_cursors = [None]
+    cursors = st.session_state.m1_cursors
+
+    df = get_page(filters, cursors[-1], page_size)
+    has_next = len(df) > page_size
+    df = df.head(page_size)
+
+    nav = st.columns([1, 1, 4])
+    if nav[0].button("⬅️ Назад", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if nav[1].button("Вперёд ➡️", disabled=not has_next):
+        last = df.iloc[-1]
+        cursors.append((last["inspection_date"], int(last["id"])))
+        st.rerun()
+    nav[2].caption(f"Страница {len(cursors)}")
 
-            # Предлагаем пользователю скачать файл
-            st.download_button(
-                label="⬇️ Скачать Excel",
-                data=output,
-                file_name='inspections.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    
+    as_categories(df, {column: get_lookup(kind) for column, kind in INSPECTIONS_LOOKUPS.items()})
+    as_categories(df, {"organization": organizations})
+    max_id = get_max_id()
 
-        
-        if cols[3].button("📄 Сформировать акт"):
-            record = df[df['id'] == selected_id].iloc[0].to_dict()
-            doc_buffer = generate_act(record)
-            if doc_buffer:
-                st.download_button(
-                    label="⬇️ Скачать акт",
-                    data=doc_buffer,
-                    file_name=f"Акт_{record['id']}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
-        
-        # Просмотр фото
-        if selected_id:
-            record = df[df['id'] == selected_id]
-            if not record.empty:
-                photo_path = record.iloc[0]['photo_path']
-                if photo_path and os.path.exists(photo_path):
-                    st.image(photo_path, caption="Прикрепленное фото", width=300)
-                else:
-                    st.warning("Для этой записи нет прикрепленного фото")
+    if max_id is not None:
+        if df.empty:
+            st.info("Нет записей, соответствующих фильтрам")
+        page_table(df, organizations)
+        record_panel(max_id, filters)
     else:
         st.info("Нет данных для отображения")
 
+    # Аналитика
+    analytics_panel(organizations)
+
+    # Массовые операции
+    bulk_panel(organizations)
+
 # --------------------------
 # Модуль 2: Проверки в СП
 # --------------------------
 
+CHECKS_COLUMNS = [
+    "ID", "Дата", "СП", "Ответственный", "ПО", "Объект", 
+    "Кол-во работ", "Зона ответ.", "Начало", "Окончание", 
+    "Персонал", "Проверки", "Нарушения", "Тип нарушения", 
+    "КПБ нарушение", "КПБ выявлено", "Акт"]
+# Выборка в порядке CHECKS_COLUMNS; ПО и справочные значения хранятся кодами
+CHECKS_SELECT = f'''SELECT id, date,
+                          {lookup_value("sp_id")} AS sp_name,
+                          {lookup_value("responsible_id")} AS responsible,
+                          {organization_name("po_id")} AS po_name,
+                          {lookup_value("object_id")} AS object,
+                          works_count,
+                          {lookup_value("zone_id")} AS responsibility_zone,
+                          start_time, end_time, personnel_count, checks_count, violations_count,
+                          {lookup_value("violation_type_id")} AS violation_type,
+                          {lookup_value("kpb_violation_id")} AS kpb_violation,
+                          kpb_detected, act_issued
+                   FROM checks'''
+CHECKS_TABLES = ["checks", ORGANIZATIONS_TABLE, LOOKUPS_TABLE]
+# Столбцы таблицы со значениями справочников и их виды
+CHECKS_LOOKUPS = {
+    "СП": "sp",
+    "Ответственный": "responsible",
+    "Объект": "site",
+    "Зона ответ.": "sp",
+    "Тип нарушения": "violation_type",
+    "КПБ нарушение": "kpb_violation",
+}
+
 def module2():
+    import pandas as pd
+
+    import analytics
+
     st.title("🏗️ Проверки в СП")
 
 
     # Функции БД
-    def init_db():
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS checks
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      date TEXT,
-                      sp_name TEXT,
-                      responsible TEXT,
-                      po_name TEXT,
-                      object TEXT,
-                      works_count INTEGER,
-                      responsibility_zone TEXT,
-                      start_time TEXT,
-                      end_time TEXT,
-                      personnel_count INTEGER,
-                      checks_count INTEGER,
-                      violations_count INTEGER,
-                      violation_type TEXT,
-                      kpb_violation TEXT,
-                      kpb_detected INTEGER,
-                      act_issued INTEGER)''')
-        c.execute('''CREATE TABLE IF NOT EXISTS photos
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      record_id INTEGER,
-                      file_path TEXT,
-                      FOREIGN KEY(record_id) REFERENCES checks(id))''')
-        conn.commit()
-        conn.close()
-
-    def add_record(data):
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
+    def add_record(data, uploaded_files=None):
+        # Запись и все её фото сохраняются как одно целое: строки checks и
+        # photos — одной транзакцией, а при ошибке записанные файлы удаляются
         try:
-            c.execute('''INSERT INTO checks 
-                     (date, sp_name, responsible, po_name, object, works_count, responsibility_zone, 
-                      start_time, end_time, personnel_count, checks_count, violations_count, 
-                      violation_type, kpb_violation, kpb_detected, act_issued) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-            record_id = c.lastrowid
-            conn.commit()
-            st.success("Запись успешно добавлена!")
-        except sqlite3.Error as e:
-            st.error(f"Ошибка при добавлении записи: {e}")
-        finally:
-            conn.close()
-            return record_id
-
-    def save_photos(record_id, uploaded_files):
-        if not uploaded_files:
-            return
-        save_dir = f"uploads/{record_id}"
-        os.makedirs(save_dir, exist_ok=True)
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
-        for uploaded_file in uploaded_files:
-            file_path = os.path.join(save_dir, uploaded_file.name)
-            with open(file_path, 'wb') as f:
-                f.write(uploaded_file.getbuffer())
-            c.execute("INSERT INTO photos (record_id, file_path) VALUES (?, ?)", 
-                     (record_id, file_path))
-        conn.commit()
-        conn.close()
+            with photo_store.staged(uploaded_files) as photo_paths, \
+                 db.transaction(SOFTWARE_DB, invalidates=["checks", "photos"]) as c:
+                c.execute('''INSERT INTO checks 
+                         (date, sp_id, responsible_id, po_id, object_id, works_count, zone_id, 
+                          start_time, end_time, personnel_count, checks_count, violations_count, 
+                          violation_type_id, kpb_violation_id, kpb_detected, act_issued) 
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
+                record_id = c.lastrowid
+                c.executemany("INSERT INTO photos (record_id, file_path) VALUES (?, ?)",
+                              [(record_id, path) for path in photo_paths])
+        except (sqlite3.Error, OSError) as e:
+            raise ValueError(f"Ошибка при добавлении записи: {e}")
+        return record_id
 
     def get_photos(record_id):
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
-        c.execute("SELECT file_path FROM photos WHERE record_id=?", (record_id,))
-        photos = [row[0] for row in c.fetchall()]
-        conn.close()
+        rows = db.fetch_all(SOFTWARE_DB, "SELECT file_path FROM photos WHERE record_id=?",
+                            (record_id,), tables=["photos"])
+        photos = [row[0] for row in rows]
         return photos
 
     def delete_record(record_id):
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
         photos = get_photos(record_id)
-        for photo in photos:
-            if os.path.exists(photo):
-                os.remove(photo)
-        c.execute("DELETE FROM photos WHERE record_id=?", (record_id,))
-        c.execute("DELETE FROM checks WHERE id=?", (record_id,))
-        conn.commit()
-        conn.close()
+        with db.transaction(SOFTWARE_DB, invalidates=["checks", "photos"]) as c:
+            c.execute("DELETE FROM photos WHERE record_id=?", (record_id,))
+            c.execute("DELETE FROM checks WHERE id=?", (record_id,))
+        photo_store.release(photos)
+        # Каталог фото записи остался от прежней схемы хранения
         dir_path = f"uploads/{record_id}"
         if os.path.exists(dir_path):
             try:
@@ -502,50 +762,96 @@ def module2():
             except OSError:
                 pass
 
-    def get_records():
-        conn = sqlite3.connect(SOFTWARE_DB)
-        c = conn.cursor()
-        c.execute("SELECT * FROM checks")
-        records = c.fetchall()
-        conn.close()
+    def delete_records(filters):
+        # Все записи по фильтру: строки checks и photos удаляются одной
+        # транзакцией, а файлы фото освобождаются в фоне
+        clauses, params = db.build_where(filters, "date")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        ids = f"SELECT id FROM checks {where}"
+        with db.transaction(SOFTWARE_DB, invalidates=["checks", "photos"]) as c:
+            c.execute(f"SELECT file_path FROM photos WHERE record_id IN ({ids})", params)
+            photos = [row[0] for row in c.fetchall()]
+            c.execute(f"DELETE FROM photos WHERE record_id IN ({ids})", params)
+            c.execute(f"DELETE FROM checks {where}", params)
+            count = c.rowcount
+        photo_store.release_later(photos)
+        return count
+
+    def mark_acts_issued(filters):
+        # Отметка «акт оформлен» всем записям по фильтру одним UPDATE
+        clauses, params = db.build_where(filters, "date")
+        clauses.append("IFNULL(act_issued, 0) = 0")
+        with db.transaction(SOFTWARE_DB, invalidates=["checks"]) as c:
+            c.execute(f"UPDATE checks SET act_issued = 1 WHERE {' AND '.join(clauses)}", params)
+            return c.rowcount
+
+    def get_records(filters, cursor=None, page_size=None):
+        # Keyset-пагинация по (date, id), новые записи сверху
+        clauses, params = db.build_where(filters, "date")
+        if cursor is not None:
+            clauses.append("(date, id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"{CHECKS_SELECT} {where} ORDER BY date DESC, id DESC"
+        if page_size is None:
+            # Полная выборка (экспорт) идёт курсором и в кэш не кладётся;
+            # использовать в блоке with
+            return db.stream(SOFTWARE_DB, query, params)
+        query += " LIMIT ?"
+        params.append(page_size + 1)
+        records = db.fetch_all(SOFTWARE_DB, query, params, tables=CHECKS_TABLES)
         return records
 
 
-        
-    # Новая функция для получения данных с путями к фото
-    def get_all_data():
-        conn = sqlite3.connect(SOFTWARE_DB)
-        df = pd.read_sql('''
-            SELECT c.*, GROUP_CONCAT(p.file_path) as photo_paths 
-            FROM checks c
-            LEFT JOIN photos p ON c.id = p.record_id
-            GROUP BY c.id
-        ''', conn)
-        conn.close()
-        df['photo_paths'] = df['photo_paths'].apply(lambda x: x.split(',') if x else [])
-        return df
+
+    def get_analytics_rows(date_from, date_to):
+        # Одна выборка за период для сводки по всем ПО и СП; показатели
+        # считаются из неё в pandas
+        return db.read_frame(SOFTWARE_DB, '''
+            SELECT date, po_id, sp_id, start_time, end_time, personnel_count,
+                   checks_count, violations_count, kpb_detected
+            FROM checks
+            WHERE date BETWEEN ? AND ?''', (date_from, date_to), tables=["checks"])
+
+    def get_daily_stats(po_id, date_from, date_to):
+        # Итоги по дням из сводки daily_stats, а не из всех строк checks.
+        # Сводку пересчитывают триггеры при записи в checks, поэтому
+        # результат зависит от checks и сбрасывается вместе с ней
+        return db.read_frame(SOFTWARE_DB, '''
+            SELECT date,
+                   SUM(records) AS records,
+                   SUM(checks_count) AS checks_count,
+                   SUM(violations_count) AS violations_count,
+                   SUM(personnel_count) AS personnel_count,
+                   SUM(kpb_detected) AS kpb_detected,
+                   SUM(acts_issued) AS acts_issued
+            FROM daily_stats
+            WHERE po_id = ? AND date BETWEEN ? AND ?
+            GROUP BY date
+            ORDER BY date''', (po_id, date_from, date_to), tables=["checks"])
+
 
     
     # Интерфейс модуля
-    init_db()
-    
 
     # Форма добавления записи
     with st.expander("➕ Добавить новую запись", expanded=True):
         with st.form("add_record_form", clear_on_submit=True):
             cols = st.columns(2)
             date = cols[0].date_input("Дата*", datetime.today())
-            date_str = date.strftime("%d.%m.%Y")  # Форматируем дату
-            sp_name = cols[1].selectbox("Наименование СП*", ["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1","КЦ-2","ЦХПП","ЦГП","УЖДТ"])
+            date_str = date.strftime(db.DATE_FORMAT)  # Дата в формате хранения
+            sp_names = get_lookup("sp")
+            sp_name = select_code(cols[1], "Наименование СП*", sp_names)
 
 
             cols1 = st.columns(3)
-            responsible = cols1[0].selectbox("Ответственный от СП*", ["Мастер Иванов И.И.", "Начальник участка Петров П.П.", "Главный специалист Сидоров С.С."])
-            object = cols1[1].selectbox("Объект/Участок", ["Участок-1", "Участок-2", "Участок-3", "Участок-4"])
-            responsibility_zone = cols1[2].selectbox("Зона ответственности (СП)",["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1","КЦ-2","ЦХПП","ЦГП","УЖДТ"])
+            responsible = select_code(cols1[0], "Ответственный от СП*", get_lookup("responsible"))
+            object = select_code(cols1[1], "Объект/Участок", get_lookup("site"))
+            responsibility_zone = select_code(cols1[2], "Зона ответственности (СП)", sp_names)
 
             cols2 = st.columns(3)
-            po_name = cols2[0].selectbox("Наименование ПО*", get_organizations())          
+            organizations = get_organization_names()
+            po_id = select_code(cols2[0], "Наименование ПО*", organizations)
             start_time = cols2[1].time_input("Время начала работ*", time(8, 0))
             end_time = cols2[2].time_input("Время окончания работ*", time(17, 0))
             
@@ -557,28 +863,12 @@ def module2():
             checks_count = cols4[0].number_input("Проведено проверок*", min_value=1)
             violations_count = cols4[1].number_input("Количество нарушений*", min_value=0)
             
-            violation_type = st.selectbox("Тип нарушения*", [
-                "Работы на высоте", 
-                "Огневые работы/Пожарная безопасность", 
-                "Грузоподъёмные работы/Работа с ПС", 
-                "Электробезопасность", 
-                "Работы в газоопасн. местах/замкнутом простр-ве", 
-                "Земляные работы", 
-                "Документы/Допуски и удостоверения", 
-                "Исправность инструментов и приспособлений", 
-                "Применение/Исправность СИЗ", 
-                "Содержание территории/рабочих мест", 
-                "Безопасность дорожного движения", "Нарушений не выявлено"
-            ])
+            violation_type = select_code(st, "Тип нарушения*", get_lookup("violation_type"))
 
 
             cols5 = st.columns(2)
-            kpb_violation = cols5[0].selectbox("Нарушения КПБ*", ["Нет",
-                "Нет алкоголю и наркотикам", 
-                "Сообщай о происшествиях", 
-                "Получи допуск", 
-                "Защити себя от падения"
-            ])
+            kpb_names = get_lookup("kpb_violation")
+            kpb_violation = select_code(cols5[0], "Нарушения КПБ*", kpb_names)
             
             act_issued = cols5[1].selectbox("Оформлен Акт*", ["Нет", "Да"])
             
@@ -590,10 +880,10 @@ def module2():
             
             if st.form_submit_button("💾 Сохранить запись"):
                 data = (
-                    date_str,  # Используем отформатированную дату
+                    date_str,
                     sp_name,
                     responsible,
-                    po_name,
+                    po_id,
                     object,
                     works_count,
                     responsibility_zone,
@@ -604,210 +894,308 @@ def module2():
                     violations_count,
                     violation_type,
                     kpb_violation,
-                    1 if kpb_violation in ("Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Защити себя от падения", "Получи допуск") else 0,
+                    1 if kpb_names.get(kpb_violation) != "Нет" else 0,
                     1 if act_issued == "Да" else 0
                 )
-                record_id = add_record(data)
-                save_photos(record_id, uploaded_files)
-                st.success("Запись успешно сохранена!")
-                st.rerun()
-
-
-    # Отображение данных
-    with st.expander("📋 Все записи", expanded=True):
-     records = get_records()
-     df = pd.DataFrame(records, columns=[
-        "ID", "Дата", "СП", "Ответственный", "ПО", "Объект", 
-        "Кол-во работ", "Зона ответ.", "Начало", "Окончание", 
-        "Персонал", "Проверки", "Нарушения", "Тип нарушения", 
-        "КПБ нарушение", "КПБ выявлено", "Акт"])
-
-
-# Преобразуем даты в формат дд.мм.гггг
-     df["Дата"] = pd.to_datetime(df["Дата"], format="%d.%m.%Y").dt.strftime("%d.%m.%Y")
+                try:
+                    add_record(data, uploaded_files)
+                    st.success("Запись успешно сохранена!")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
 
-    
-     st.dataframe(
-        df.drop(columns=["КПБ выявлено"]),
-        use_container_width=True,
-        hide_index=True)
-
-# Управление записями
-     cols = st.columns(4)
-     selected_id = cols[0].number_input("Введите ID записи", min_value=1)
-
-     if cols[1].button("🗑️ Удалить запись"):
-        delete_record(selected_id)
-        st.success("Запись удалена!")
-        st.rerun()
 
-        
-     if selected_id:
-        photos = get_photos(selected_id)
-        if photos:
-            cols = st.columns(3)
-            for i, photo in enumerate(photos):
-                with cols[i % 3]:
-                    st.image(photo, use_container_width=True, width=300)
-        else:
-            st.warning("Нет фото для этой записи")
-
-        # Заглушка на кнопку редактирование 
-       # if st.button("✏️ Редактирование записи"):
-        # record = get_record_by_id(selected_id)  # Получаем данные записи по ID
-       #  if record:
-          #       with st.form("edit_form"):
-          #           st.write("Редактирование записи ID:", selected_id)
-                    # Предзаполняем поля формы текущими данными
-          #           edit_date = st.date_input("Дата", datetime.strptime(record[1], "%d.%m.%Y"))
-          #           edit_sp_name = st.selectbox("СП", ["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1", "КЦ-2", "ЦХПП", "ЦГП", "УЖДТ"], index=["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1", "КЦ-2", "ЦХПП", "ЦГП", "УЖДТ"].index(record[2]))
-          #           edit_responsible = st.text_input("Ответственный", value=record[3])
-          #           edit_po_name = st.selectbox("ПО", get_organizations(), index=get_organizations().index(record[4]))
-            #         edit_object = st.text_input("Объект", value=record[5])
-              #       edit_works_count = st.number_input("Кол-во работ", value=record[6])
-                #     edit_responsibility_zone = st.text_input("Зона ответственности", value=record[7])
-                  #   edit_start_time = st.time_input("Начало работ", value=datetime.strptime(record[8], "%H:%M").time())
-                    # edit_end_time = st.time_input("Окончание работ", value=datetime.strptime(record[9], "%H:%M").time())
-                   #  edit_personnel_count = st.number_input("Кол-во персонала", value=record[10])
-                 #    edit_checks_count = st.number_input("Проведено проверок", value=record[11])
-                   #  edit_violations_count = st.number_input("Количество нарушений", value=record[12])
-                   #  edit_violation_type = st.selectbox("Тип нарушения", [
-                 #        "Работы на высоте", "Огневые работы/Пожарная безопасность", 
-                   #      "Грузоподъёмные работы/Работа с ПС", "Электробезопасность", 
-                 #        "Работы в газоопасн. местах/замкнутом простр-ве", 
-                 #        "Земляные работы", "Документы/Допуски и удостоверения", 
-                #         "Исправность инструментов и приспособлений", 
-                 #        "Применение/Исправность СИЗ", 
-                #         "Содержание территории/рабочих мест", 
-                #         "Безопасность дорожного движения", "Нарушений не выявлено"
-                    # ], index=[
-                #         "Работы на высоте", "Огневые работы/Пожарная безопасность", 
-                #         "Грузоподъёмные работы/Работа с ПС", "Электробезопасность", 
-                #         "Работы в газоопасн. местах/замкнутом простр-ве", 
-                #         "Земляные работы", "Документы/Допуски и удостоверения", 
-                 #        "Исправность инструментов и приспособлений", 
-                 #        "Применение/Исправность СИЗ", 
-                 #        "Содержание территории/рабочих мест", 
-                 #        "Безопасность дорожного движения", "Нарушений не выявлено"
-               #      ].index(record[13]))
-               #      edit_kpb_violation = st.selectbox("Нарушения КПБ", ["Нет", "Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Получи допуск", "Защити себя от падения"], index=["Нет", "Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Получи допуск", "Защити себя от падения"].index(record[14]))
-                #     edit_act_issued = st.selectbox("Акт оформлен", ["Нет", "Да"], index=0 if record[16] == 0 else 1)
-
-                    
-                 #    edit_date_str = edit_date.strftime("%d.%m.%Y")  # Форматируем дату
-
-                 #    if st.form_submit_button("Сохранить изменения"):
-                 #        data =(
-                  #           edit_date.strftime("%d.%m.%Y"),
-                  #           edit_sp_name,
-                  #           edit_responsible,
-                  #           edit_po_name,
-                  #           edit_object,
-                  #           edit_works_count,
-                  #           edit_responsibility_zone,
-                  #           edit_start_time.strftime("%H:%M"),
-                   #          edit_end_time.strftime("%H:%M"),
-                   #          edit_personnel_count,
-                   #          edit_checks_count,
-                   #          edit_violations_count,
-                   #          edit_violation_type,
-                   #          edit_kpb_violation,
-                   #          1 if kpb_violation in ("Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Защити себя от падения", "Получи допуск") else 0,
-                    #         1 if edit_act_issued =="Да" else 0,
-                    #         selected_id)
-
-                    # Логируем данные
-                    
-
-                    # Удаляем старую запись
-                    
-                    # Добавляем новую запись
-                  #   record_id = add_record(data)
-                  #   st.success("Изменения сохранены!")
-                    # st.rerun()"
-    
+    # Фрагменты страницы: виджеты внутри фрагмента перезапускают только
+    # его, а не весь модуль с формами и остальными выборками
+    @st.fragment
+    def records_table(organizations, sp_names):
+        cols = st.columns(3)
+        filters = {
+            "sp_id": select_code(cols[0], "СП", sp_names, "Все"),
+            "po_id": select_code(cols[1], "ПО", organizations, "Все"),
+            "zone_id": select_code(cols[2], "Зона ответственности", sp_names, "Все"),
+        }
+        cols = st.columns(3)
+        filters["date_from"] = cols[0].date_input("Дата с", value=None, format="DD.MM.YYYY")
+        filters["date_to"] = cols[1].date_input("Дата по", value=None, format="DD.MM.YYYY")
+        page_size = cols[2].selectbox("Записей на странице", PAGE_SIZES, index=1)
+
+        # Курсоры начала страниц; при смене фильтров листаем с начала
+        filters_key = (tuple(filters.items()), page_size)
+        if st.session_state.get("m2_filters_key") != filters_key:
+            st.session_state.m2_filters_key = filters_key
+            st.session_state.m2_cursors = [None]
+        cursors = st.session_state.m2_cursors
+
+        records = get_records(filters, cursors[-1], page_size)
+        has_next = len(records) > page_size
+        records = records[:page_size]
+
+        nav = st.columns([1, 1, 4])
+        # Курсор меняется в обработчике до перезапуска фрагмента, поэтому
+        # листание перезапускает только таблицу и обходится без st.rerun()
+        nav[0].button("⬅️ Назад", disabled=len(cursors) == 1, on_click=cursors.pop)
+        nav[1].button("Вперёд ➡️", disabled=not has_next, on_click=cursors.append,
+                      args=((records[-1][1], records[-1][0]) if has_next else None,))
+        nav[2].caption(f"Страница {len(cursors)}")
+
+        df = pd.DataFrame(records, columns=CHECKS_COLUMNS)
+
+        # Преобразуем даты в формат дд.мм.гггг только для видимой страницы
+        format_dates(df, ["Дата"])
+        as_categories(df, {column: get_lookup(kind) for column, kind in CHECKS_LOOKUPS.items()})
+        as_categories(df, {"ПО": organizations})
+
+        st.dataframe(
+            df.drop(columns=["КПБ выявлено"]),
+            use_container_width=True,
+            hide_index=True)
 
-     if st.button("📥 Экспорт в Excel"):
-
-            # Создаем новый Excel-файл
-            wb = Workbook()
-            ws = wb.active
-            # Заголовки столбцов
-            ws.append(df.columns.tolist())
-    
-            # Данные
-            for row in df.itertuples(index=False):
-                ws.append(row)
-    
-            # Сохраняем файл в буфер
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
+        if st.button("📥 Экспорт в Excel"):
+            # Выгружаем все записи по текущим фильтрам, а не только страницу
+            with get_records(filters) as rows:
+                output = export.write_xlsx(rows, CHECKS_COLUMNS, date_columns=["Дата"])
 
             # Предлагаем пользователю скачать файл
             st.download_button(
                 label="⬇️ Скачать Excel",
                 data=output,
                 file_name='sp_checks.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                mime=export.XLSX_MIME)
+
+    @st.fragment
+    def record_panel():
+        # Смена ID перечитывает только фото выбранной записи
+        cols = st.columns(4)
+        selected_id = cols[0].number_input("Введите ID записи", min_value=1)
+
+        if cols[1].button("🗑️ Удалить запись"):
+            delete_record(selected_id)
+            st.success("Запись удалена!")
+            st.rerun()  # Вся страница: таблица изменилась
+
+        record = get_record_by_id(selected_id) if selected_id else None
+        if record is not None:
+            photos = record["photos"]
+            if photos:
+                cols = st.columns(3)
+                for i, photo in enumerate(photos):
+                    with cols[i % 3]:
+                        thumbnail = photo_store.thumbnail_path(photo)
+                        if thumbnail is None:
+                            st.warning("Файл фото не найден")
+                            continue
+                        st.image(thumbnail, use_container_width=True)
+                        if st.button("🔍 Открыть фото", key=f"open_photo_{i}"):
+                            show_full_photo(photo, key=f"original_{i}")
+            else:
+                st.warning("Нет фото для этой записи")
+
+            # Заглушка на кнопку редактирование 
+           # if st.button("✏️ Редактирование записи"):
+            # record = get_record_by_id(selected_id)  # Получаем данные записи по ID
+           #  if record:
+              #       with st.form("edit_form"):
+              #           st.write("Редактирование записи ID:", selected_id)
+                        # Предзаполняем поля формы текущими данными
+              #           edit_date = st.date_input("Дата", datetime.strptime(record[1], "%d.%m.%Y"))
+              #           edit_sp_name = st.selectbox("СП", ["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1", "КЦ-2", "ЦХПП", "ЦГП", "УЖДТ"], index=["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1", "КЦ-2", "ЦХПП", "ЦГП", "УЖДТ"].index(record[2]))
+              #           edit_responsible = st.text_input("Ответственный", value=record[3])
+              #           edit_po_name = st.selectbox("ПО", get_organizations(), index=get_organizations().index(record[4]))
+                #         edit_object = st.text_input("Объект", value=record[5])
+                  #       edit_works_count = st.number_input("Кол-во работ", value=record[6])
+                    #     edit_responsibility_zone = st.text_input("Зона ответственности", value=record[7])
+                      #   edit_start_time = st.time_input("Начало работ", value=datetime.strptime(record[8], "%H:%M").time())
+                        # edit_end_time = st.time_input("Окончание работ", value=datetime.strptime(record[9], "%H:%M").time())
+                       #  edit_personnel_count = st.number_input("Кол-во персонала", value=record[10])
+                     #    edit_checks_count = st.number_input("Проведено проверок", value=record[11])
+                       #  edit_violations_count = st.number_input("Количество нарушений", value=record[12])
+                       #  edit_violation_type = st.selectbox("Тип нарушения", [
+                     #        "Работы на высоте", "Огневые работы/Пожарная безопасность", 
+                       #      "Грузоподъёмные работы/Работа с ПС", "Электробезопасность", 
+                     #        "Работы в газоопасн. местах/замкнутом простр-ве", 
+                     #        "Земляные работы", "Документы/Допуски и удостоверения", 
+                    #         "Исправность инструментов и приспособлений", 
+                     #        "Применение/Исправность СИЗ", 
+                    #         "Содержание территории/рабочих мест", 
+                    #         "Безопасность дорожного движения", "Нарушений не выявлено"
+                        # ], index=[
+                    #         "Работы на высоте", "Огневые работы/Пожарная безопасность", 
+                    #         "Грузоподъёмные работы/Работа с ПС", "Электробезопасность", 
+                    #         "Работы в газоопасн. местах/замкнутом простр-ве", 
+                    #         "Земляные работы", "Документы/Допуски и удостоверения", 
+                     #        "Исправность инструментов и приспособлений", 
+                     #        "Применение/Исправность СИЗ", 
+                     #        "Содержание территории/рабочих мест", 
+                     #        "Безопасность дорожного движения", "Нарушений не выявлено"
+                   #      ].index(record[13]))
+                   #      edit_kpb_violation = st.selectbox("Нарушения КПБ", ["Нет", "Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Получи допуск", "Защити себя от падения"], index=["Нет", "Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Получи допуск", "Защити себя от падения"].index(record[14]))
+                    #     edit_act_issued = st.selectbox("Акт оформлен", ["Нет", "Да"], index=0 if record[16] == 0 else 1)
+
+
+                     #    edit_date_str = edit_date.strftime("%d.%m.%Y")  # Форматируем дату
+
+                     #    if st.form_submit_button("Сохранить изменения"):
+                     #        data =(
+                      #           edit_date.strftime("%d.%m.%Y"),
+                      #           edit_sp_name,
+                      #           edit_responsible,
+                      #           edit_po_name,
+                      #           edit_object,
+                      #           edit_works_count,
+                      #           edit_responsibility_zone,
+                      #           edit_start_time.strftime("%H:%M"),
+                       #          edit_end_time.strftime("%H:%M"),
+                       #          edit_personnel_count,
+                       #          edit_checks_count,
+                       #          edit_violations_count,
+                       #          edit_violation_type,
+                       #          edit_kpb_violation,
+                       #          1 if kpb_violation in ("Нет алкоголю и наркотикам", "Сообщай о происшествиях", "Защити себя от падения", "Получи допуск") else 0,
+                        #         1 if edit_act_issued =="Да" else 0,
+                        #         selected_id)
+
+                        # Логируем данные
+
+
+                        # Удаляем старую запись
+
+                        # Добавляем новую запись
+                      #   record_id = add_record(data)
+                      #   st.success("Изменения сохранены!")
+                        # st.rerun()"
+
+    @st.fragment
+    def report_panel():
+        with st.expander("📈 Аналитика и отчеты"):
+            organizations = get_organization_names()
+            selected_po_id = select_code(st, "Выберите ПО", organizations)
+            selected_po = organizations.get(selected_po_id)
+
+            cols = st.columns(2)
+            start_date = cols[0].date_input("Начальная дата", datetime.today())
+            end_date = cols[1].date_input("Конечная дата", datetime.today())
+
+            # Границы периода в формате хранения
+            start_date_str = start_date.strftime(db.DATE_FORMAT)
+            end_date_str = end_date.strftime(db.DATE_FORMAT)
+
+            if st.button("Сгенерировать отчет"):
+                df = get_daily_stats(selected_po_id, start_date_str, end_date_str)
+
+                # Преобразуем даты в формат дд.мм.гггг
+                format_dates(df, ['date'])
+
+                # График строится один раз на ПО, период и версию данных;
+                # одни и те же PNG-байты идут на экран и в Excel
+                png = charts.cached_png(
+                    ("violations", selected_po, start_date_str, end_date_str,
+                     db.data_version(SOFTWARE_DB, ["checks"])),
+                    lambda: charts.line_chart_png(
+                        df['date'], df['violations_count'],
+                        title=f"Динамика нарушений для {selected_po}",
+                        xlabel="Дата", ylabel="Количество нарушений"))
+                st.image(png)
+
+                # Выгрузка в excel
+                from openpyxl.drawing.image import Image as OpenpyxlImage
+
+                output = io.BytesIO()
+                with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                    df.to_excel(writer, sheet_name='Данные', index=False)
+
+                    workbook = writer.book
+                    worksheet = workbook.create_sheet('График')
+                    img = OpenpyxlImage(io.BytesIO(png))
+                    worksheet.add_image(img, 'A1')
+
+                output.seek(0)
+                st.download_button(
+                    label="📥 Скачать отчет",
+                    data=output,
+                    file_name=f"Отчет_{selected_po}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+
+    @st.fragment
+    def dashboard_panel(organizations, sp_names):
+        with st.expander("📊 Показатели по всем ПО и СП"):
+            cols = st.columns(4)
+            dash_from = cols[0].date_input("Начало периода", datetime.today() - timedelta(days=90),
+                                           format="DD.MM.YYYY", key="dash_from")
+            dash_to = cols[1].date_input("Конец периода", datetime.today(),
+                                         format="DD.MM.YYYY", key="dash_to")
+            frequency = cols[2].selectbox("Шаг", list(analytics.FREQUENCIES), key="dash_frequency")
+            dimension = cols[3].selectbox("Разрез", ["ПО", "СП"], key="dash_dimension")
+            level, names = ("po_id", organizations) if dimension == "ПО" else ("sp_id", sp_names)
+
+            rows = get_analytics_rows(dash_from.strftime(db.DATE_FORMAT), dash_to.strftime(db.DATE_FORMAT))
+            if rows.empty:
+                st.info("Нет проверок за выбранный период")
+            else:
+                sums = analytics.checks_sums(rows, frequency)
+
+                # Итоги за весь период
+                totals = analytics.rates(sums, [level]).rename(index=names)
+                totals.index.name = dimension
+                st.dataframe(
+                    totals[["checks_count", "violations_count", *analytics.RATE_COLUMNS]]
+                    .rename(columns={"checks_count": "Проверок", "violations_count": "Нарушений",
+                                     **analytics.RATE_COLUMNS})
+                    .round(2),
+                    use_container_width=True)
+
+                # Динамика выбранного показателя по периодам
+                rate = st.selectbox("Показатель", list(analytics.RATE_COLUMNS),
+                                    format_func=analytics.RATE_COLUMNS.get, key="dash_rate")
+                by_period = analytics.rates(sums, ["date", level])[rate].unstack(level)
+                st.line_chart(by_period.rename(columns=names))
+
+    @st.fragment
+    def bulk_panel(organizations):
+        with st.expander("🧹 Массовые операции"):
+            cols = st.columns(3)
+            bulk_filters = {
+                "po_id": select_code(cols[0], "ПО", organizations, "Все", key="m2_bulk_po"),
+                "date_from": cols[1].date_input("Период с", datetime.today().replace(day=1),
+                                                format="DD.MM.YYYY", key="m2_bulk_from"),
+                "date_to": cols[2].date_input("Период по", datetime.today(),
+                                              format="DD.MM.YYYY", key="m2_bulk_to"),
+            }
+            if not (bulk_filters["date_from"] and bulk_filters["date_to"]):
+                st.warning("Укажите период")
+                return
+
+            cols = st.columns(3)
+            if cols[0].button("📝 Отметить акты оформленными"):
+                try:
+                    count = mark_acts_issued(bulk_filters)
+                    st.success(f"Отмечено записей: {count}")
+                    st.rerun()  # Вся страница: таблица изменилась
+                except sqlite3.Error as e:
+                    st.error(f"Ошибка при обновлении записей: {e}")
+            confirmed = cols[1].checkbox("Подтверждаю удаление", key="m2_bulk_confirm")
+            if cols[2].button("🗑️ Удалить записи за период", disabled=not confirmed):
+                try:
+                    count = delete_records(bulk_filters)
+                    st.success(f"Удалено записей: {count}")
+                    st.rerun()  # Вся страница: таблица изменилась
+                except sqlite3.Error as e:
+                    st.error(f"Ошибка при удалении записей: {e}")
+
+    # Отображение данных
+    with st.expander("📋 Все записи", expanded=True):
+        records_table(organizations, sp_names)
+        record_panel()
 
     # Аналитика
-    with st.expander("📈 Аналитика и отчеты"):
-        po_list = get_organizations()
-        selected_po = st.selectbox("Выберите ПО", po_list)
-        
-        cols = st.columns(2)
-        start_date = cols[0].date_input("Начальная дата", datetime.today())
-        end_date = cols[1].date_input("Конечная дата", datetime.today())
+    report_panel()
 
-        # Преобразуем даты в формат дд.мм.гггг
-        start_date_str = start_date.strftime("%d.%m.%Y")
-        end_date_str = end_date.strftime("%d.%m.%Y")
-        
-        if st.button("Сгенерировать отчет"):
-            conn = sqlite3.connect(SOFTWARE_DB)
-            query = f"""
-                SELECT date, violations_count 
-                FROM checks 
-                WHERE po_name = '{selected_po}' 
-                AND date BETWEEN '{start_date_str}' 
-                AND '{end_date_str}'
-            """
-            df = pd.read_sql(query, conn)
-            conn.close()
-
-            # Преобразуем даты в формат дд.мм.гггг
-            df['date'] = pd.to_datetime(df['date'], format="%d.%m.%Y").dt.strftime("%d.%m.%Y")
-            
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.plot(df['date'], df['violations_count'], marker='o', linestyle='-') 
-            ax.set_xlabel("Дата")
-            ax.set_ylabel("Количество нарушений")
-            ax.set_title(f"Динамика нарушений для {selected_po}")
-            ax.grid(True)
-            st.pyplot(fig)
-
-            # Выгрузка в excel
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Данные', index=False)
-                
-                buf = io.BytesIO()
-                fig.savefig(buf, format='png', bbox_inches='tight')
-                buf.seek(0)
-                
-                workbook = writer.book
-                worksheet = workbook.create_sheet('График')
-                img = OpenpyxlImage(buf)
-                worksheet.add_image(img, 'A1')
-            
-            output.seek(0)
-            st.download_button(
-                label="📥 Скачать отчет",
-                data=output,
-                file_name=f"Отчет_{selected_po}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+    # Сводка по всем ПО и СП сразу
+    dashboard_panel(organizations, sp_names)
+
+    # Массовые операции
+    bulk_panel(organizations)
 
 # --------------------------
 # Модуль 3: Управление организациями
@@ -815,7 +1203,6 @@ def module2():
 
 def module3():
     st.title("🏢 Список ПО")
-    init_common_db()
 
     with st.expander("➕ Добавить организацию", expanded=True):
         with st.form("add_org_form", clear_on_submit=True):
@@ -872,64 +1259,82 @@ def module3():
                 orgs
             )
             if cols[1].button("🗑️ Удалить"):
-                delete_organization(selected_org)
-                st.success("Организация удалена!")
-                st.rerun()
+                try:
+                    delete_organization(selected_org)
+                    st.success("Организация удалена!")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
         else:
             st.warning("Нет зарегистрированных организаций")
 
+    # Объём фото по организациям: обход файлов, поэтому только по кнопке
+    with st.expander("💾 Хранилище фото", expanded=False):
+        if st.button("📊 Посчитать объём"):
+            import pandas as pd
+
+            report = pd.DataFrame(photo_store.storage_report(), columns=["Организация", "Файлов", "Байт"])
+            report["МБ"] = (report.pop("Байт") / 1024 / 1024).round(1)
+            st.dataframe(report, hide_index=True)
+            st.caption(f"Всего: {report['МБ'].sum():.1f} МБ")
+
 # --------------------------
 # Общие вспомогательные функции
 # --------------------------
 
-def save_uploaded_file(uploaded_file):
-    if uploaded_file is not None:
-        file_ext = uploaded_file.name.split('.')[-1]
-        filename = f"{uuid.uuid4()}.{file_ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, 'wb') as f:
-            f.write(uploaded_file.getbuffer())
-        return file_path
-    return None
+def show_full_photo(photo_path, key=None):
+    # Крупная web-копия, исходный файл — только по отдельной кнопке
+    st.image(photo_store.web_path(photo_path), use_container_width=True)
+    with open(photo_path, "rb") as f:
+        st.download_button("⬇️ Скачать оригинал", f, file_name=os.path.basename(photo_path), key=key)
+
+def format_dates(df, columns):
+    """Переводит столбцы с датами из формата хранения в дд.мм.гггг."""
+    import pandas as pd
+
+    for column in columns:
+        df[column] = pd.to_datetime(
+            df[column], format=db.DATE_FORMAT, errors="coerce"
+        ).dt.strftime(db.DISPLAY_DATE_FORMAT)
+    return df
+
+def format_date(value):
+    """Дата из формата хранения в дд.мм.гггг; пустое значение остаётся как есть."""
+    if not value:
+        return value
+    return datetime.strptime(value, db.DATE_FORMAT).strftime(db.DISPLAY_DATE_FORMAT)
+
+def as_categories(df, columns):
+    """Переводит столбцы справочников в тип category.
+
+    `columns` — {столбец: {код: значение}}. Каждое значение хранится в
+    кадре один раз, а столбец — массивом небольших кодов.
+    """
+    import pandas as pd
+
+    for column, names in columns.items():
+        df[column] = df[column].astype(pd.CategoricalDtype(list(names.values())))
+    return df
 
 def generate_act(record):
     try:
-        doc = Document("template.docx")
-        replacements = {
-            "{inspection_date}": record.get("inspection_date", ""),
-            "{object}": record.get("object", ""),
-            "{section}": record.get("section", ""),
-            "{organization}": record.get("organization", ""),
-            "{violator_name}": record.get("violator_name", ""),
-            "{violation_description}": record.get("violation_description", ""),
-            "{violation_type}": record.get("violation_type", ""),
-            "{violation_category}": record.get("violation_category", ""),
-            "{risk_level}": record.get("risk_level", ""),
-            "{inspector_name}": record.get("inspector_name", ""),
-            "{elimination_date}": record.get("elimination_date", ""),
-            "{elimination_status}": record.get("elimination_status", "")
-        }
-        
-        for para in doc.paragraphs:
-            for key, value in replacements.items():
-                if key in para.text:
-                    para.text = para.text.replace(key, str(value))
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for key, value in replacements.items():
-                        if key in cell.text:
-                            cell.text = cell.text.replace(key, str(value))
-
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer
+        return io.BytesIO(acts.render_act(record))
     except Exception as e:
         st.error(f"Ошибка генерации акта: {str(e)}")
         return None
 
+def generate_acts_zip(records):
+    progress_bar = st.progress(0.0, text="Формирование актов...")
+
+    def report(done, total):
+        progress_bar.progress(done / total, text=f"Сформировано актов: {done} из {total}")
+
+    try:
+        return acts.render_acts_zip(records, progress=report)
+    except Exception as e:
+        st.error(f"Ошибка генерации актов: {str(e)}")
+        return None
+
 # --------------------------
 # Запуск приложения
 # --------------------------
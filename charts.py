@@ -0,0 +1,58 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+# --------------------------
+# Графики для отчётов
+# --------------------------
+
+# Фигуры создаются напрямую через Figure на холсте Agg, без pyplot: они не
+# попадают в глобальный реестр фигур pyplot и освобождаются сборщиком
+# мусора, а не копятся в долгоживущем процессе сервера. matplotlib
+# импортируется при первом построении графика
+CHART_CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", "64"))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def line_chart_png(x, y, title, xlabel, ylabel):
+    """Линейный график в виде PNG (bytes)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    try:
+        ax = fig.subplots()
+        ax.plot(x, y, marker="o", linestyle="-")
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+        ax.grid(True)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+def cached_png(key, render):
+    """PNG по ключу `key` из кэша или построенный вызовом `render()`.
+
+    В ключ входит версия данных (db.data_version), поэтому после записи
+    в таблицы график строится заново, а старые версии вытесняются по LRU.
+    """
+    with _lock:
+        png = _cache.get(key)
+        if png is not None:
+            _cache.move_to_end(key)
+            return png
+    png = render()
+    with _lock:
+        _cache[key] = png
+        _cache.move_to_end(key)
+        while len(_cache) > CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return png
@@ -0,0 +1,756 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+# --------------------------
+# Базы данных приложения
+# --------------------------
+
+DATABASE_NAME = "inspections.db"
+COMMON_DB = "common.db"
+SOFTWARE_DB = "software_checks.db"
+
+# Имена, под которыми базы присоединяются (ATTACH) к соединению с любой
+# другой из них: справочник организаций и записи модулей доступны в
+# одном запросе, например common.organizations из inspections.db
+SCHEMAS = {
+    COMMON_DB: "common",
+    DATABASE_NAME: "inspections_db",
+    SOFTWARE_DB: "software",
+}
+
+# Настройки соединений (можно переопределить через переменные окружения)
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", "256"))
+# Сколько свободных соединений с каждой базой держать открытыми
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "512"))
+# Страховка на случай записи в базу в обход приложения
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "300"))
+
+
+# --------------------------
+# Менеджер соединений
+# --------------------------
+
+class ConnectionManager:
+    """Пул соединений с базами, общий для всех потоков процесса.
+
+    Streamlit выполняет каждый перезапуск скрипта в новом потоке, поэтому
+    соединения не привязаны к потоку: их берут из пула на время одного
+    запроса или транзакции и возвращают обратно. Свободных соединений с
+    каждой базой хранится не больше `pool_size`, лишние закрываются. К
+    каждому соединению присоединяются остальные базы из `attached`.
+    """
+
+    def __init__(self, busy_timeout_ms=BUSY_TIMEOUT_MS, mmap_size=MMAP_SIZE,
+                 cached_statements=CACHED_STATEMENTS, attached=SCHEMAS,
+                 pool_size=POOL_SIZE):
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.attached = attached
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+
+    def _open(self, path):
+        # Соединение переходит между потоками, но в каждый момент занято
+        # только одним из них
+        conn = sqlite3.connect(
+            path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        schemas = ["main"]
+        for other, schema in self.attached.items():
+            if other != path:
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (other,))
+                schemas.append(schema)
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        for schema in schemas:
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+            conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+            conn.execute(f"PRAGMA {schema}.mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def acquire(self, path):
+        with self._lock:
+            idle = self._idle[path]
+            if idle:
+                return idle.pop()
+        return self._open(path)
+
+    def release(self, path, conn):
+        if conn.in_transaction:
+            # Незавершённую транзакцию (например, после ошибки) не отдаём
+            # другому потоку
+            conn.rollback()
+        with self._lock:
+            idle = self._idle[path]
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self, path):
+        conn = self.acquire(path)
+        try:
+            yield conn
+        finally:
+            self.release(path, conn)
+
+    def close_all(self):
+        """Закрывает свободные соединения (занятые закроются при возврате)."""
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+_manager = ConnectionManager()
+
+
+def connection(path):
+    """Соединение с базой `path` из пула на время блока with."""
+    return _manager.connection(path)
+
+
+@contextmanager
+def stream(path, sql, params=()):
+    """Курсор запроса без кэша, для выгрузок: строки читаются по мере обхода.
+
+    Соединение занято, пока открыт блок with.
+    """
+    with connection(path) as conn:
+        cursor = conn.execute(sql, params)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+@contextmanager
+def transaction(path, invalidates=()):
+    """Курсор внутри транзакции: commit при успехе, rollback при ошибке.
+
+    После успешного commit из кэша запросов удаляются результаты,
+    зависящие от таблиц `invalidates`.
+    """
+    with connection(path) as conn:
+        with conn:
+            yield conn.cursor()
+    invalidate(path, *invalidates)
+
+
+def close_all():
+    _manager.close_all()
+
+
+# --------------------------
+# Кэш результатов запросов
+# --------------------------
+
+_MISS = object()
+
+
+class QueryCache:
+    """Общий для всех сессий LRU-кэш результатов чтения.
+
+    Ключ — (база, SQL, параметры). Каждая запись помнит таблицы, из
+    которых она прочитана; запись в таблицу увеличивает её поколение и
+    выбрасывает зависящие от неё результаты. Результат, прочитанный
+    во время параллельной записи, в кэш не попадает.
+
+    Таблица задаётся именем в базе запроса или парой (база, имя) —
+    для таблиц присоединённых баз.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_table = defaultdict(set)
+        self._generations = defaultdict(int)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISS
+            created, value, _ = entry
+            if time.monotonic() - created > self.ttl:
+                self._discard(key)
+                return _MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self, path, tables):
+        with self._lock:
+            return tuple(self._generations[table] for table in _table_keys(path, tables))
+
+    def put(self, key, value, path, tables, generation):
+        with self._lock:
+            tables = _table_keys(path, tables)
+            if generation != tuple(self._generations[table] for table in tables):
+                return
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (time.monotonic(), value, tables)
+            for table in tables:
+                self._keys_by_table[table].add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, path, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[(path, table)] += 1
+                for key in list(self._keys_by_table.get((path, table), ())):
+                    self._discard(key)
+
+    def _discard(self, key):
+        # Вызывается под блокировкой: запись удаляется вместе с её ключом
+        # в индексе по таблицам, чтобы индекс не рос при вытеснении по LRU и TTL
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._keys_by_table[table]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_table[table]
+
+
+def _table_keys(path, tables):
+    return [table if isinstance(table, tuple) else (path, table) for table in tables]
+
+
+_cache = QueryCache()
+
+
+def invalidate(path, *tables):
+    """Сбрасывает закэшированные чтения из таблиц `tables` базы `path`."""
+    _cache.invalidate(path, *tables)
+
+
+def data_version(path, tables):
+    """Версия данных таблиц `tables`: меняется после каждой записи в них.
+
+    Подходит как часть ключа для кэшей производных данных (графиков и т.п.).
+    """
+    return _cache.generation(path, tables)
+
+
+def _cached(key, path, tables, load):
+    value = _cache.get(key)
+    if value is _MISS:
+        generation = _cache.generation(path, tables)
+        value = load()
+        _cache.put(key, value, path, tables, generation)
+    return value
+
+
+def fetch_all(path, sql, params=(), tables=()):
+    """Строки запроса через общий кэш; `tables` — таблицы, от которых он зависит."""
+    params = tuple(params)
+
+    def load():
+        with connection(path) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    rows = _cached(("rows", path, sql, params), path, tables, load)
+    return list(rows)
+
+
+def fetch_one(path, sql, params=(), tables=()):
+    rows = fetch_all(path, sql, params, tables)
+    return rows[0] if rows else None
+
+
+def fetch_record(path, sql, params=(), tables=()):
+    """Первая строка запроса словарём {столбец: значение} или None.
+
+    Для карточек записей: ключ кэша включает параметры, поэтому каждая
+    запись (по ID) кэшируется отдельно и сбрасывается записью в `tables`.
+    """
+    params = tuple(params)
+
+    def load():
+        with connection(path) as conn:
+            cursor = conn.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    record = _cached(("record", path, sql, params), path, tables, load)
+    return None if record is None else dict(record)
+
+
+def read_frame(path, sql, params=(), tables=()):
+    """Как pd.read_sql, но через общий кэш. Возвращает копию кадра."""
+    import pandas as pd
+
+    params = tuple(params)
+
+    def load():
+        with connection(path) as conn:
+            return pd.read_sql(sql, conn, params=params)
+
+    df = _cached(("frame", path, sql, params), path, tables, load)
+    return df.copy()
+
+
+def update_rows(cursor, table, changes):
+    """UPDATE только изменённых столбцов в открытой транзакции.
+
+    `changes` — {id: {столбец: значение}}. Строки с одинаковым набором
+    столбцов обновляются одним executemany. Имена столбцов подставляются
+    в SQL как есть и должны браться из кода, а не из ввода.
+    """
+    groups = defaultdict(list)
+    for record_id, values in changes.items():
+        columns = tuple(sorted(values))
+        groups[columns].append([values[column] for column in columns] + [record_id])
+    for columns, rows in groups.items():
+        assignments = ", ".join(f"{column}=?" for column in columns)
+        cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id=?", rows)
+
+
+def build_where(filters, date_column):
+    """Условия WHERE из словаря фильтров.
+
+    Ключи `date_from`/`date_to` задают период по `date_column`, остальные
+    ключи — имена столбцов для сравнения на равенство. Пустые значения
+    пропускаются. Возвращает списки условий и параметров.
+    """
+    clauses, params = [], []
+    for column, value in filters.items():
+        if not value or column in ("date_from", "date_to"):
+            continue
+        clauses.append(f"{column} = ?")
+        params.append(value)
+    if filters.get("date_from"):
+        clauses.append(f"{date_column} >= ?")
+        params.append(filters["date_from"].strftime(DATE_FORMAT))
+    if filters.get("date_to"):
+        clauses.append(f"{date_column} <= ?")
+        params.append(filters["date_to"].strftime(DATE_FORMAT))
+    return clauses, params
+
+
+# --------------------------
+# Миграции схемы
+# --------------------------
+
+# Даты хранятся как TEXT в формате ISO-8601 (YYYY-MM-DD): такие строки
+# сортируются и сравниваются так же, как сами даты, поэтому BETWEEN
+# по ним использует индекс. В интерфейсе даты показываются как дд.мм.гггг.
+DATE_FORMAT = "%Y-%m-%d"
+DISPLAY_DATE_FORMAT = "%d.%m.%Y"
+
+
+def _iso_date_update(table, column):
+    """Перевод столбца из дд.мм.гггг в ISO-формат (для миграций)."""
+    return f'''UPDATE {table}
+               SET {column} = substr({column}, 7, 4) || '-' ||
+                              substr({column}, 4, 2) || '-' ||
+                              substr({column}, 1, 2)
+               WHERE {column} GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'
+            '''
+
+
+def _rebuild_table_steps(table, columns, indexes=()):
+    """Пересоздание таблицы только со столбцами `columns` (для миграций).
+
+    Заменяет ALTER TABLE ... DROP COLUMN, которого нет в SQLite до 3.35
+    (в Debian bullseye — 3.34.1): новая таблица, копирование строк,
+    удаление старой и переименование новой. `columns` — определения
+    столбцов, остальные столбцы удаляются. Счётчик AUTOINCREMENT
+    переносится, индексы `indexes` создаются заново.
+    """
+    new_table = f"{table}_new"
+    names = ", ".join(column.split()[0] for column in columns)
+    return [
+        f"CREATE TABLE {new_table} ({', '.join(columns)})",
+        f"INSERT INTO {new_table} ({names}) SELECT {names} FROM {table}",
+        f"DELETE FROM sqlite_sequence WHERE name = '{new_table}'",
+        f"""INSERT INTO sqlite_sequence (name, seq)
+            SELECT '{new_table}', seq FROM sqlite_sequence WHERE name = '{table}'""",
+        f"DROP TABLE {table}",
+        f"ALTER TABLE {new_table} RENAME TO {table}",
+        *indexes,
+    ]
+
+
+def _organization_id_steps(table, name_column, id_column, date_column, old_index, new_index):
+    """Замена названия организации ссылкой на organizations.id (для миграций).
+
+    Названия, которых нет в справочнике, добавляются в него, чтобы записи
+    не потеряли организацию. Сам столбец с названием удаляется позже,
+    при пересборке таблицы в _lookup_code_steps.
+    """
+    organizations = f"{SCHEMAS[COMMON_DB]}.organizations"
+    return [
+        f"ALTER TABLE {table} ADD COLUMN {id_column} INTEGER",
+        f"""INSERT OR IGNORE INTO {organizations} (name)
+            SELECT DISTINCT {name_column} FROM {table} WHERE {name_column} <> ''""",
+        f'''UPDATE {table}
+            SET {id_column} = (SELECT o.id FROM {organizations} o
+                               WHERE o.name = {table}.{name_column})''',
+        f"DROP INDEX IF EXISTS {old_index}",
+        f"CREATE INDEX IF NOT EXISTS {new_index} ON {table}({id_column}, {date_column})",
+    ]
+
+
+# Исходные значения справочников (common.lookups), по видам; раньше эти
+# списки были зашиты в формы модулей
+LOOKUP_SEEDS = {
+    "inspection_object": ["УТЭЦ-2", "АНГЦ-5", "Стан 2000", "КЦ-1", "КЦ-2", "АТУ", "ДЦ-1",
+                          "ДЦ-2", "ЦХПП", "ЦГП", "УЖДТ"],
+    "section": ["Участок монтажа м\\к", "Сварочный участок", "Участок установки оборудования",
+                "Ось 11-3", "Отметка +45.100", "Маслоподвал"],
+    "violation_type": ["Работы на высоте", "Огневые работы/Пожарная безопасность",
+                       "Грузоподъёмные работы/Работа с ПС", "Электробезопасность",
+                       "Работы в газоопасн. местах/замкнутом простр-ве", "Земляные работы",
+                       "Документы/Допуски и удостоверения",
+                       "Исправность инструментов и приспособлений",
+                       "Применение/Исправность СИЗ", "Содержание территории/рабочих мест",
+                       "Безопасность дорожного движения", "Нарушений не выявлено"],
+    "violation_category": ["Применение СИЗ", "Обучение и аттестации", "ППР", "Леса",
+                           "Анкерные линии", "Другое"],
+    "risk_level": ["высокий", "средний", "низкий"],
+    "inspector": ["Супервайзер ИТК Иванов И.И.", "Специалист ОТиПБ Петров П.П.",
+                  "Специалист ОТ ПО Сидоров С.С."],
+    "elimination_status": ["не устранено", "устранено"],
+    "sp": ["АТУ", "ДЦ-1", "ДЦ-2", "КЦ-1", "КЦ-2", "ЦХПП", "ЦГП", "УЖДТ"],
+    "responsible": ["Мастер Иванов И.И.", "Начальник участка Петров П.П.",
+                    "Главный специалист Сидоров С.С."],
+    "site": ["Участок-1", "Участок-2", "Участок-3", "Участок-4"],
+    "kpb_violation": ["Нет", "Нет алкоголю и наркотикам", "Сообщай о происшествиях",
+                      "Получи допуск", "Защити себя от падения"],
+}
+
+
+def _seed_lookups(conn):
+    conn.executemany(
+        "INSERT OR IGNORE INTO lookups (kind, value, position) VALUES (?, ?, ?)",
+        [(kind, value, position)
+         for kind, values in LOOKUP_SEEDS.items()
+         for position, value in enumerate(values)])
+
+
+def _lookup_code_steps(table, columns, keep, indexes):
+    """Замена текстовых столбцов кодами из common.lookups (для миграций).
+
+    `columns` — тройки (столбец, столбец кода, вид справочника). Значения,
+    которых нет в справочнике, добавляются в конец своего вида. Затем
+    таблица пересобирается один раз со столбцами `keep` и кодами, а все
+    текстовые столбцы (и название организации) удаляются; `indexes`
+    создаются заново.
+    """
+    lookups = f"{SCHEMAS[COMMON_DB]}.lookups"
+    steps = []
+    for column, code_column, kind in columns:
+        steps += [
+            f"ALTER TABLE {table} ADD COLUMN {code_column} INTEGER",
+            f"""INSERT OR IGNORE INTO {lookups} (kind, value)
+                SELECT DISTINCT '{kind}', {column} FROM {table} WHERE {column} <> ''""",
+            f'''UPDATE {table}
+                SET {code_column} = (SELECT l.id FROM {lookups} l
+                                     WHERE l.kind = '{kind}' AND l.value = {table}.{column})''',
+        ]
+    return steps + _rebuild_table_steps(
+        table, keep + [f"{code_column} INTEGER" for _, code_column, _ in columns], indexes)
+
+
+# Сводка checks по дням для аналитики: строка на дату × ПО × СП × тип
+# нарушения. Её ведут триггеры на checks, поэтому отчёты читают готовые
+# суммы вместо просмотра всех проверок. NULL в ключе заменяется на 0/''
+# (NULL в PRIMARY KEY не совпадает сам с собой и ломает ON CONFLICT)
+_DAILY_STATS_KEY = "date, po_id, sp_id, violation_type_id"
+_DAILY_STATS_SUMS = "records, checks_count, violations_count, personnel_count, kpb_detected, acts_issued"
+
+
+def _daily_stats_values(row, sign):
+    """Вклад строки checks (NEW/OLD) в сводку со знаком `sign`."""
+    return (f"IFNULL({row}.date, ''), IFNULL({row}.po_id, 0), IFNULL({row}.sp_id, 0), "
+            f"IFNULL({row}.violation_type_id, 0), {sign}1, "
+            f"{sign}IFNULL({row}.checks_count, 0), {sign}IFNULL({row}.violations_count, 0), "
+            f"{sign}IFNULL({row}.personnel_count, 0), {sign}IFNULL({row}.kpb_detected, 0), "
+            f"{sign}IFNULL({row}.act_issued, 0)")
+
+
+def _daily_stats_upsert(row, sign):
+    return f'''INSERT INTO daily_stats ({_DAILY_STATS_KEY}, {_DAILY_STATS_SUMS})
+                VALUES ({_daily_stats_values(row, sign)})
+                ON CONFLICT ({_DAILY_STATS_KEY}) DO UPDATE SET
+                    records = records + excluded.records,
+                    checks_count = checks_count + excluded.checks_count,
+                    violations_count = violations_count + excluded.violations_count,
+                    personnel_count = personnel_count + excluded.personnel_count,
+                    kpb_detected = kpb_detected + excluded.kpb_detected,
+                    acts_issued = acts_issued + excluded.acts_issued;'''
+
+
+def _daily_stats_cleanup(row):
+    # Строка сводки, в которой не осталось проверок, удаляется
+    return (f"DELETE FROM daily_stats WHERE po_id = IFNULL({row}.po_id, 0) "
+            f"AND date = IFNULL({row}.date, '') AND sp_id = IFNULL({row}.sp_id, 0) "
+            f"AND violation_type_id = IFNULL({row}.violation_type_id, 0) AND records = 0;")
+
+
+# Для каждой базы — список шагов; номер шага (с единицы) записывается
+# в PRAGMA user_version. Шаг — список SQL-выражений или функция,
+# принимающая соединение. Новые изменения схемы добавляются только
+# в конец списка, уже выпущенные шаги не редактируются.
+MIGRATIONS = {
+    COMMON_DB: [
+        # 1: исходная схема
+        [
+            '''CREATE TABLE IF NOT EXISTS organizations
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE)''',
+        ],
+        # 2: справочники значений для выпадающих списков; position — порядок в списке
+        [
+            '''CREATE TABLE IF NOT EXISTS lookups
+               (id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                position INTEGER,
+                UNIQUE (kind, value))''',
+        ],
+        # 3: исходные значения справочников
+        _seed_lookups,
+    ],
+    DATABASE_NAME: [
+        # 1: исходная схема
+        [
+            '''CREATE TABLE IF NOT EXISTS inspections
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                inspection_date TEXT,
+                object TEXT,
+                section TEXT,
+                organization TEXT,
+                violator_name TEXT,
+                violation_description TEXT,
+                violation_type TEXT,
+                violation_category TEXT,
+                risk_level TEXT,
+                inspector_name TEXT,
+                elimination_date TEXT,
+                elimination_status TEXT,
+                photo_path TEXT)''',
+        ],
+        # 2: даты в ISO-формате и индекс для выборок по организации за период
+        [
+            _iso_date_update("inspections", "inspection_date"),
+            _iso_date_update("inspections", "elimination_date"),
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_org_date
+               ON inspections(organization, inspection_date)''',
+        ],
+        # 3: индексы для фильтров и постраничного вывода таблицы
+        [
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_date
+               ON inspections(inspection_date)''',
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_object_date
+               ON inspections(object, inspection_date)''',
+        ],
+        # 4: подсчёт ссылок на файлы фото
+        [
+            "CREATE INDEX IF NOT EXISTS idx_inspections_photo_path ON inspections(photo_path)",
+        ],
+        # 5: организация — ссылка на справочник вместо названия
+        _organization_id_steps("inspections", "organization", "organization_id",
+                               "inspection_date", "idx_inspections_org_date",
+                               "idx_inspections_org_id_date"),
+        # 6: повторяющиеся строки — коды справочника common.lookups
+        ["DROP INDEX IF EXISTS idx_inspections_object_date"]
+        + _lookup_code_steps("inspections", [
+            ("object", "object_id", "inspection_object"),
+            ("section", "section_id", "section"),
+            ("violation_type", "violation_type_id", "violation_type"),
+            ("violation_category", "violation_category_id", "violation_category"),
+            ("risk_level", "risk_level_id", "risk_level"),
+            ("inspector_name", "inspector_id", "inspector"),
+            ("elimination_status", "elimination_status_id", "elimination_status"),
+        ], ["id INTEGER PRIMARY KEY AUTOINCREMENT", "inspection_date TEXT",
+            "violator_name TEXT", "violation_description TEXT", "elimination_date TEXT",
+            "photo_path TEXT", "organization_id INTEGER"], [
+            "CREATE INDEX IF NOT EXISTS idx_inspections_date ON inspections(inspection_date)",
+            "CREATE INDEX IF NOT EXISTS idx_inspections_photo_path ON inspections(photo_path)",
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_org_id_date
+               ON inspections(organization_id, inspection_date)''',
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_object_id_date
+               ON inspections(object_id, inspection_date)''',
+        ]),
+        # 7: список просроченных неустранённых нарушений — поиск по индексу
+        [
+            '''CREATE INDEX IF NOT EXISTS idx_inspections_status_due
+               ON inspections(elimination_status_id, elimination_date)''',
+        ],
+    ],
+    SOFTWARE_DB: [
+        # 1: исходная схема
+        [
+            '''CREATE TABLE IF NOT EXISTS checks
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT,
+                sp_name TEXT,
+                responsible TEXT,
+                po_name TEXT,
+                object TEXT,
+                works_count INTEGER,
+                responsibility_zone TEXT,
+                start_time TEXT,
+                end_time TEXT,
+                personnel_count INTEGER,
+                checks_count INTEGER,
+                violations_count INTEGER,
+                violation_type TEXT,
+                kpb_violation TEXT,
+                kpb_detected INTEGER,
+                act_issued INTEGER)''',
+            '''CREATE TABLE IF NOT EXISTS photos
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                record_id INTEGER,
+                file_path TEXT,
+                FOREIGN KEY(record_id) REFERENCES checks(id))''',
+        ],
+        # 2: поиск фото по записи
+        [
+            "CREATE INDEX IF NOT EXISTS idx_photos_record_id ON photos(record_id)",
+        ],
+        # 3: даты в ISO-формате и индекс для отчётов по ПО за период
+        [
+            _iso_date_update("checks", "date"),
+            "CREATE INDEX IF NOT EXISTS idx_checks_po_date ON checks(po_name, date)",
+        ],
+        # 4: индексы для фильтров и постраничного вывода таблицы
+        [
+            "CREATE INDEX IF NOT EXISTS idx_checks_date ON checks(date)",
+            "CREATE INDEX IF NOT EXISTS idx_checks_sp_date ON checks(sp_name, date)",
+            '''CREATE INDEX IF NOT EXISTS idx_checks_zone_date
+               ON checks(responsibility_zone, date)''',
+        ],
+        # 5: подсчёт ссылок на файлы фото
+        [
+            "CREATE INDEX IF NOT EXISTS idx_photos_file_path ON photos(file_path)",
+        ],
+        # 6: ПО — ссылка на справочник организаций вместо названия
+        _organization_id_steps("checks", "po_name", "po_id", "date",
+                               "idx_checks_po_date", "idx_checks_po_id_date"),
+        # 7: повторяющиеся строки — коды справочника common.lookups
+        ["DROP INDEX IF EXISTS idx_checks_sp_date", "DROP INDEX IF EXISTS idx_checks_zone_date"]
+        + _lookup_code_steps("checks", [
+            ("sp_name", "sp_id", "sp"),
+            ("responsible", "responsible_id", "responsible"),
+            ("object", "object_id", "site"),
+            ("responsibility_zone", "zone_id", "sp"),
+            ("violation_type", "violation_type_id", "violation_type"),
+            ("kpb_violation", "kpb_violation_id", "kpb_violation"),
+        ], ["id INTEGER PRIMARY KEY AUTOINCREMENT", "date TEXT", "works_count INTEGER",
+            "start_time TEXT", "end_time TEXT", "personnel_count INTEGER",
+            "checks_count INTEGER", "violations_count INTEGER", "kpb_detected INTEGER",
+            "act_issued INTEGER", "po_id INTEGER"], [
+            "CREATE INDEX IF NOT EXISTS idx_checks_date ON checks(date)",
+            "CREATE INDEX IF NOT EXISTS idx_checks_po_id_date ON checks(po_id, date)",
+            "CREATE INDEX IF NOT EXISTS idx_checks_sp_id_date ON checks(sp_id, date)",
+            "CREATE INDEX IF NOT EXISTS idx_checks_zone_id_date ON checks(zone_id, date)",
+        ]),
+        # 8: сводка по дням для аналитики, которую ведут триггеры
+        [
+            '''CREATE TABLE IF NOT EXISTS daily_stats
+               (date TEXT NOT NULL,
+                po_id INTEGER NOT NULL,
+                sp_id INTEGER NOT NULL,
+                violation_type_id INTEGER NOT NULL,
+                records INTEGER NOT NULL,
+                checks_count INTEGER NOT NULL,
+                violations_count INTEGER NOT NULL,
+                personnel_count INTEGER NOT NULL,
+                kpb_detected INTEGER NOT NULL,
+                acts_issued INTEGER NOT NULL,
+                PRIMARY KEY (po_id, date, sp_id, violation_type_id)) WITHOUT ROWID''',
+            "CREATE INDEX IF NOT EXISTS idx_daily_stats_date ON daily_stats(date)",
+            f'''INSERT INTO daily_stats ({_DAILY_STATS_KEY}, {_DAILY_STATS_SUMS})
+               SELECT IFNULL(date, ''), IFNULL(po_id, 0), IFNULL(sp_id, 0),
+                      IFNULL(violation_type_id, 0), COUNT(*),
+                      TOTAL(checks_count), TOTAL(violations_count), TOTAL(personnel_count),
+                      TOTAL(kpb_detected), TOTAL(act_issued)
+               FROM checks
+               GROUP BY 1, 2, 3, 4''',
+            f'''CREATE TRIGGER IF NOT EXISTS daily_stats_insert AFTER INSERT ON checks
+               BEGIN
+                   {_daily_stats_upsert("NEW", "")}
+               END''',
+            f'''CREATE TRIGGER IF NOT EXISTS daily_stats_delete AFTER DELETE ON checks
+               BEGIN
+                   {_daily_stats_upsert("OLD", "-")}
+                   {_daily_stats_cleanup("OLD")}
+               END''',
+            f'''CREATE TRIGGER IF NOT EXISTS daily_stats_update
+               AFTER UPDATE OF date, po_id, sp_id, violation_type_id, checks_count,
+                               violations_count, personnel_count, kpb_detected, act_issued
+               ON checks
+               BEGIN
+                   {_daily_stats_upsert("OLD", "-")}
+                   {_daily_stats_upsert("NEW", "")}
+                   {_daily_stats_cleanup("OLD")}
+               END''',
+        ],
+    ],
+}
+
+
+def schema_version(path):
+    with connection(path) as conn:
+        return _user_version(conn)
+
+
+def _user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path):
+    """Применяет к базе `path` недостающие шаги миграций.
+
+    Возвращает номер версии схемы после применения.
+    """
+    steps = MIGRATIONS[path]
+    with connection(path) as conn:
+        if _user_version(conn) >= len(steps):
+            return len(steps)
+
+        # BEGIN IMMEDIATE сразу берёт блокировку на запись, поэтому два
+        # процесса не применят один и тот же шаг дважды
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = _user_version(conn)
+            for number, step in enumerate(steps[version:], start=version + 1):
+                if callable(step):
+                    step(conn)
+                else:
+                    for statement in step:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version={number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(steps)
+
+
+def migrate_all():
+    # Справочник организаций (COMMON_DB) мигрирует первым: на него
+    # ссылаются шаги остальных баз
+    for path in MIGRATIONS:
+        migrate(path)
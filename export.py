@@ -0,0 +1,63 @@
+import os
+import tempfile
+from datetime import date
+
+# --------------------------
+# Потоковая выгрузка в Excel
+# --------------------------
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXCEL_DATE_FORMAT = "DD.MM.YYYY"
+
+
+def write_xlsx(rows, headers, date_columns=(), sheet_title="Данные"):
+    """Пишет строки в xlsx-файл, не собирая их в памяти.
+
+    `rows` — любой итерируемый источник кортежей, обычно курсор SQLite:
+    строки забираются по одной и сразу уходят в write-only книгу.
+    Столбцы из `date_columns` (имена из `headers`) пишутся как настоящие
+    даты Excel, остальные значения — как есть, с типами из базы.
+    Возвращает открытый на чтение временный файл.
+    """
+    # openpyxl нужен только при выгрузке, поэтому импортируется здесь
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    ws.append(list(headers))
+
+    date_indexes = [i for i, name in enumerate(headers) if name in date_columns]
+    for row in rows:
+        if date_indexes:
+            row = list(row)
+            for i in date_indexes:
+                row[i] = _date_cell(ws, row[i])
+        ws.append(row)
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+        output = open(path, "rb")
+    finally:
+        try:
+            # Открытый дескриптор держит данные, имя в каталоге не нужно
+            os.unlink(path)
+        except OSError:
+            pass
+    return output
+
+
+def _date_cell(ws, value):
+    from openpyxl.cell import WriteOnlyCell
+
+    if not value:
+        return value
+    try:
+        value = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        # Не дата в формате хранения — оставляем как есть
+        return value
+    cell = WriteOnlyCell(ws, value=value)
+    cell.number_format = EXCEL_DATE_FORMAT
+    return cell
@@ -0,0 +1,509 @@
+import argparse
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+import db
+
+# --------------------------
+# Хранилище фото
+# --------------------------
+
+# Фото хранятся по хэшу содержимого: uploads/blobs/ab/cd/abcd....jpg.
+# Одинаковые файлы записываются один раз, имена не конфликтуют, а два
+# уровня подкаталогов держат каталоги небольшими. Ссылки на файл — это
+# inspections.photo_path и photos.file_path; файл удаляется, когда на
+# него не осталось ни одной ссылки.
+UPLOAD_FOLDER = "uploads"
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, "blobs")
+_EXTENSIONS = {"jpeg": "jpg"}
+CHUNK_SIZE = 1024 * 1024
+SAVE_WORKERS = 4
+
+# Проверка ссылок с удалением файла и фиксация новых ссылок на уже
+# имеющийся файл идут под этой блокировкой: иначе release() может
+# удалить файл-дубликат, пока ссылающаяся на него запись ещё не записана
+_refs_lock = threading.RLock()
+
+
+def blob_path(digest, ext):
+    return os.path.join(BLOB_FOLDER, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+
+def _extension(file_name):
+    ext = os.path.splitext(file_name)[1].lstrip(".").lower() or "bin"
+    return _EXTENSIONS.get(ext, ext)
+
+
+def save(uploaded_file):
+    """Сохраняет загруженный файл в хранилище и возвращает путь к нему.
+
+    Файл читается и пишется порциями по CHUNK_SIZE с подсчётом хэша на
+    лету, так что целиком в памяти не копируется. Если такой файл уже
+    есть, копия удаляется и возвращается путь к имеющемуся.
+    """
+    uploaded_file.seek(0)
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    # Пишем во временный файл и переименовываем: другие сессии не
+    # увидят недописанный файл
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_FOLDER, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: uploaded_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        path = blob_path(digest.hexdigest(), _extension(uploaded_file.name))
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    try:
+        make_variants(path)
+    except OSError:
+        # Создадутся при первом показе
+        pass
+    return path
+
+
+def save_many(uploaded_files):
+    """Сохраняет несколько файлов параллельно; пути — в порядке загрузки.
+
+    Если хотя бы один файл записать не удалось, уже записанные файлы
+    без ссылок удаляются, а ошибка пробрасывается дальше.
+    """
+    uploaded_files = list(uploaded_files or [])
+    if not uploaded_files:
+        return []
+    # Запись на диск и уменьшение изображений (Pillow) отпускают GIL
+    with ThreadPoolExecutor(max_workers=min(SAVE_WORKERS, len(uploaded_files))) as pool:
+        futures = [pool.submit(save, f) for f in uploaded_files]
+    paths, error = [], None
+    for future in futures:
+        try:
+            paths.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        release(paths)
+        raise error
+    return paths
+
+
+@contextmanager
+def staged(uploaded_files):
+    """Файлы для записей, которые ещё только сохраняются в базу.
+
+    Внутри блока выполняется транзакция со ссылками на `paths`. Если блок
+    завершился ошибкой, транзакция уже откачена, и записанные файлы без
+    ссылок удаляются — в хранилище не остаётся «сирот». Блок выполняется
+    под _refs_lock, поэтому уже имевшиеся файлы не удалит release().
+    """
+    uploaded_files = list(uploaded_files or [])
+    paths = save_many(uploaded_files)
+    with _refs_lock:
+        for uploaded_file, path in zip(uploaded_files, paths):
+            if not os.path.exists(path):
+                # Имевшийся файл освободили до захвата блокировки
+                save(uploaded_file)
+        try:
+            yield paths
+        except BaseException:
+            release(paths)
+            raise
+
+
+def ref_count(path):
+    """Сколько записей обеих баз ссылается на файл `path`."""
+    with db.connection(db.DATABASE_NAME) as conn:
+        inspections = conn.execute(
+            "SELECT COUNT(*) FROM inspections WHERE photo_path = ?", (path,)).fetchone()[0]
+    with db.connection(db.SOFTWARE_DB) as conn:
+        checks = conn.execute(
+            "SELECT COUNT(*) FROM photos WHERE file_path = ?", (path,)).fetchone()[0]
+    return inspections + checks
+
+
+def release(paths):
+    """Удаляет файлы, на которые после удаления записей не осталось ссылок.
+
+    Вызывается после commit удаления строк из базы.
+    """
+    with _refs_lock:
+        for path in set(paths):
+            if isinstance(path, str) and path and ref_count(path) == 0:
+                delete_photo(path)
+
+
+# Отложенное освобождение: один фоновый поток, задания идут по очереди
+_releaser = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-release")
+
+
+def _release_batches(paths):
+    try:
+        for start in range(0, len(paths), GC_BATCH_SIZE):
+            batch = paths[start:start + GC_BATCH_SIZE]
+            with _refs_lock:
+                referenced = _referenced(batch)
+                for path in batch:
+                    if path not in referenced:
+                        delete_photo(path)
+    except Exception:
+        # Оставшиеся файлы подберёт collect_garbage
+        logging.getLogger(__name__).exception("Ошибка освобождения фото")
+
+
+def release_later(paths):
+    """Как release, но в фоновом потоке и порциями по GC_BATCH_SIZE.
+
+    Для массовых удалений: ссылки проверяются одним запросом на порцию, а
+    пользователь не ждёт удаления файлов. Возвращает Future или None.
+    """
+    paths = sorted({path for path in paths if isinstance(path, str) and path})
+    if not paths:
+        return None
+    return _releaser.submit(_release_batches, paths)
+
+
+# --------------------------
+# Уменьшенные копии
+# --------------------------
+
+# Рядом с оригиналом хранятся две копии в JPEG:
+#   <имя>.web.jpg   — для просмотра в браузере (по длинной стороне WEB_SIZE)
+#   <имя>.thumb.jpg — миниатюра для таблиц и галерей (THUMB_SIZE)
+# Копии создаются при загрузке, а для старых фото — при первом обращении.
+WEB_SIZE = 1600
+THUMB_SIZE = 320
+WEB_QUALITY = 82
+THUMB_QUALITY = 75
+
+_VARIANTS = {
+    "web": (WEB_SIZE, WEB_QUALITY),
+    "thumb": (THUMB_SIZE, THUMB_QUALITY),
+}
+
+
+def variant_path(path, variant):
+    return f"{os.path.splitext(path)[0]}.{variant}.jpg"
+
+
+def make_variants(path):
+    """Создаёт web-копию и миниатюру для оригинала `path`."""
+    # Pillow нужен только при загрузке фото, а не при каждом показе страницы
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        # Фото с телефона часто повёрнуты только тегом EXIF
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        for variant, (size, quality) in _VARIANTS.items():
+            copy = image.copy()
+            copy.thumbnail((size, size))
+            # Одно и то же фото могут сохранять две сессии сразу
+            target = variant_path(path, variant)
+            tmp_path = f"{target}.{threading.get_ident()}.part"
+            copy.save(tmp_path, "JPEG", quality=quality, optimize=True)
+            os.replace(tmp_path, target)
+
+
+def _variant(path, variant):
+    # В DataFrame пустой путь может прийти как None или NaN
+    if not isinstance(path, str) or not os.path.exists(path):
+        return None
+    target = variant_path(path, variant)
+    if not os.path.exists(target):
+        try:
+            make_variants(path)
+        except OSError:
+            # Не изображение или файл повреждён — отдаём оригинал
+            return path
+    return target
+
+
+def web_path(path):
+    """Путь к копии для просмотра (None, если оригинала нет)."""
+    return _variant(path, "web")
+
+
+def thumbnail_path(path):
+    """Путь к миниатюре (None, если оригинала нет)."""
+    return _variant(path, "thumb")
+
+
+@lru_cache(maxsize=1024)
+def _data_uri(path, mtime):
+    with open(path, "rb") as f:
+        return "data:image/jpeg;base64," + base64.b64encode(f.read()).decode("ascii")
+
+
+def thumbnail_data_uri(path):
+    """Миниатюра в виде data URI — так её принимает st.column_config.ImageColumn."""
+    thumb = thumbnail_path(path)
+    if thumb is None:
+        return None
+    return _data_uri(thumb, os.path.getmtime(thumb))
+
+
+def delete_photo(path):
+    """Удаляет оригинал вместе с уменьшенными копиями."""
+    if not isinstance(path, str) or not path:
+        return
+    for file_path in [path] + [variant_path(path, variant) for variant in _VARIANTS]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+# --------------------------
+# Сборка мусора и отчёт по хранилищу
+# --------------------------
+
+QUARANTINE_FOLDER = os.path.join(UPLOAD_FOLDER, ".quarantine")
+# Файлы моложе этого возраста не трогаем: их запись в базу может быть
+# ещё не завершена
+GC_MIN_AGE = 3600
+GC_BATCH_SIZE = 500
+GC_PAUSE = 0.2
+GC_INTERVAL = int(os.environ.get("PHOTO_GC_INTERVAL", str(6 * 3600)))
+# Сколько файлы лежат в карантине до окончательного удаления
+QUARANTINE_MAX_AGE = int(os.environ.get("PHOTO_QUARANTINE_MAX_AGE", str(30 * 24 * 3600)))
+_VARIANT_SUFFIXES = tuple(f".{variant}.jpg" for variant in _VARIANTS)
+
+
+def _walk_files(root):
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            if entry.path != QUARANTINE_FOLDER:
+                yield from _walk_files(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            yield entry
+
+
+def _referenced(paths):
+    """Какие из путей `paths` упоминаются в базах."""
+    placeholders = ",".join("?" * len(paths))
+    found = set()
+    for path, sql in [
+        (db.DATABASE_NAME, f"SELECT photo_path FROM inspections WHERE photo_path IN ({placeholders})"),
+        (db.SOFTWARE_DB, f"SELECT file_path FROM photos WHERE file_path IN ({placeholders})"),
+    ]:
+        with db.connection(path) as conn:
+            found.update(row[0] for row in conn.execute(sql, paths))
+    return found
+
+
+def _original_exists(variant_file):
+    base = variant_file[:-len(next(s for s in _VARIANT_SUFFIXES if variant_file.endswith(s)))]
+    directory, name = os.path.split(base)
+    try:
+        return any(os.path.splitext(entry)[0] == name for entry in os.listdir(directory or "."))
+    except OSError:
+        return False
+
+
+def _dispose(path, quarantine):
+    if quarantine:
+        target = os.path.join(QUARANTINE_FOLDER, os.path.relpath(path, UPLOAD_FOLDER))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        # Срок хранения в карантине отсчитывается от переноса
+        os.utime(target)
+    else:
+        os.remove(path)
+
+
+def _prune_empty_dirs(root):
+    # Обход снизу вверх: к родителю переходим, когда пустые подкаталоги
+    # уже удалены, а список subdirs у os.walk составлен до этого
+    for directory, _, _ in os.walk(root, topdown=False):
+        if directory != root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # Не пуст
+                pass
+
+
+def purge_quarantine(max_age=QUARANTINE_MAX_AGE):
+    """Удаляет из uploads/.quarantine файлы, пролежавшие там дольше `max_age` сек.
+
+    Возвращает (число файлов, байт).
+    """
+    purged, size = 0, 0
+    if not os.path.isdir(QUARANTINE_FOLDER):
+        return purged, size
+    now = time.time()
+    for directory, _, files in os.walk(QUARANTINE_FOLDER):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime < max_age:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            purged += 1
+            size += stat.st_size
+    return purged, size
+
+
+def collect_garbage(quarantine=True, min_age=GC_MIN_AGE, batch_size=GC_BATCH_SIZE, pause=GC_PAUSE,
+                    quarantine_age=QUARANTINE_MAX_AGE):
+    """Находит в uploads/ файлы, на которые нет ссылок в базах.
+
+    Каталог обходится порциями по `batch_size` файлов: для каждой порции
+    ссылки проверяются одним запросом по индексу к каждой базе, между
+    порциями делается пауза, чтобы не мешать запросам пользователей.
+    Осиротевшие оригиналы переносятся в uploads/.quarantine (или
+    удаляются при quarantine=False), осиротевшие уменьшенные копии и
+    недописанные .part-файлы удаляются. Файлы, пролежавшие в карантине
+    дольше `quarantine_age` сек, удаляются окончательно. Возвращает
+    словарь со счётчиками.
+    """
+    stats = {"checked": 0, "orphans": 0, "variants": 0, "bytes": 0,
+             "purged": 0, "purged_bytes": 0}
+    if not os.path.isdir(UPLOAD_FOLDER):
+        return stats
+    now = time.time()
+
+    def process(batch):
+        with _refs_lock:
+            referenced = _referenced([entry.path for entry in batch])
+            for entry in batch:
+                if entry.path not in referenced:
+                    try:
+                        size = entry.stat().st_size
+                        _dispose(entry.path, quarantine)
+                    except FileNotFoundError:
+                        # Удалён параллельно (release или другой проход очистки)
+                        continue
+                    stats["orphans"] += 1
+                    stats["bytes"] += size
+                    for variant in _VARIANTS:
+                        try:
+                            os.remove(variant_path(entry.path, variant))
+                        except FileNotFoundError:
+                            pass
+
+    batch = []
+    for entry in _walk_files(UPLOAD_FOLDER):
+        try:
+            if now - entry.stat().st_mtime < min_age:
+                continue
+        except FileNotFoundError:
+            # Уже удалён: копия оригинала, убранного в этом же проходе
+            continue
+        stats["checked"] += 1
+        if entry.name.endswith(".part"):
+            os.remove(entry.path)
+        elif entry.name.endswith(_VARIANT_SUFFIXES):
+            if not _original_exists(entry.path):
+                stats["variants"] += 1
+                os.remove(entry.path)
+        else:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                process(batch)
+                batch = []
+                time.sleep(pause)
+    if batch:
+        process(batch)
+
+    stats["purged"], stats["purged_bytes"] = purge_quarantine(quarantine_age)
+    _prune_empty_dirs(UPLOAD_FOLDER)
+    return stats
+
+
+def storage_report():
+    """Объём фото по организациям: [(организация, файлов, байт)].
+
+    Файл, общий для нескольких записей одной организации, считается один
+    раз; размер включает уменьшенные копии.
+    """
+    # Обе базы с записями присоединены к соединению со справочником
+    with db.connection(db.COMMON_DB) as conn:
+        rows = conn.execute(f'''
+        SELECT o.name, i.photo_path
+        FROM {db.SCHEMAS[db.DATABASE_NAME]}.inspections i
+        LEFT JOIN organizations o ON o.id = i.organization_id
+        WHERE i.photo_path IS NOT NULL
+        UNION ALL
+        SELECT o.name, p.file_path
+        FROM {db.SCHEMAS[db.SOFTWARE_DB]}.photos p
+        JOIN {db.SCHEMAS[db.SOFTWARE_DB]}.checks c ON c.id = p.record_id
+        LEFT JOIN organizations o ON o.id = c.po_id''').fetchall()
+    files_by_org = {}
+    for organization, file_path in rows:
+        files_by_org.setdefault(organization or "—", set()).add(file_path)
+
+    report = []
+    for organization, paths in files_by_org.items():
+        size = 0
+        for path in paths:
+            for file_path in [path] + [variant_path(path, variant) for variant in _VARIANTS]:
+                if os.path.exists(file_path):
+                    size += os.path.getsize(file_path)
+        report.append((organization, len(paths), size))
+    return sorted(report, key=lambda row: row[2], reverse=True)
+
+
+def _gc_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            collect_garbage()
+        except Exception:
+            logging.getLogger(__name__).exception("Ошибка очистки хранилища фото")
+
+
+def start_gc_thread(interval=GC_INTERVAL):
+    """Запускает периодическую очистку в фоновом потоке (0 — отключено)."""
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=_gc_loop, args=(interval,), name="photo-gc", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание хранилища фото")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gc_parser = commands.add_parser("gc", help="найти и убрать файлы без ссылок")
+    gc_parser.add_argument("--delete", action="store_true",
+                           help="удалять, а не переносить в uploads/.quarantine")
+    gc_parser.add_argument("--min-age", type=int, default=GC_MIN_AGE,
+                           help="не трогать файлы моложе, сек (по умолчанию %(default)s)")
+    gc_parser.add_argument("--quarantine-age", type=int, default=QUARANTINE_MAX_AGE,
+                           help="удалять из карантина файлы старше, сек (по умолчанию %(default)s)")
+    commands.add_parser("report", help="объём фото по организациям")
+    args = parser.parse_args(argv)
+
+    db.migrate_all()
+    if args.command == "gc":
+        stats = collect_garbage(quarantine=not args.delete, min_age=args.min_age,
+                                quarantine_age=args.quarantine_age)
+        print(f"Проверено файлов: {stats['checked']}, без ссылок: {stats['orphans']} "
+              f"({stats['bytes'] / 1024 / 1024:.1f} МБ), лишних копий: {stats['variants']}, "
+              f"удалено из карантина: {stats['purged']} "
+              f"({stats['purged_bytes'] / 1024 / 1024:.1f} МБ)")
+    else:
+        for organization, files, size in storage_report():
+            print(f"{organization}\t{files}\t{size / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
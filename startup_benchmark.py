@@ -0,0 +1,60 @@
+"""Замер холодного старта приложения.
+
+Импортирует app.py в отдельных процессах (как при первом запросе после
+перезапуска контейнера), выводит медианное время импорта и список
+тяжёлых библиотек, загруженных при старте. Код возврата 1, если время
+больше бюджета или при старте загружена хотя бы одна тяжёлая библиотека.
+
+    python startup_benchmark.py [--runs 5] [--budget 0.8]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Библиотеки, которые должны загружаться только при первом использовании
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "docx", "openpyxl", "PIL"]
+STARTUP_BUDGET = 0.8  # секунд
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(runs):
+    results = []
+    env = dict(os.environ, PHOTO_GC_INTERVAL="0")
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET,
+                        help="допустимое медианное время импорта, сек (по умолчанию %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    median = statistics.median(result["elapsed"] for result in results)
+    loaded = sorted({module for result in results for module in result["loaded"]})
+    print(f"Импорт app.py: медиана {median:.3f} с за {args.runs} запусков (бюджет {args.budget} с)")
+    print(f"Тяжёлые библиотеки при старте: {', '.join(loaded) or 'нет'}")
+    return 1 if median > args.budget or loaded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())